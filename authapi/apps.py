@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AuthapiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "authapi"
+
+    def ready(self):
+        # Registers the token cache eviction signals
+        from . import authentication  # noqa: F401
@@ -0,0 +1,274 @@
+"""
+Token authentication backed by a two level cache.
+
+A token resolves to a compact snapshot of its user (SNAPSHOT_FIELDS),
+kept in a small in-process LRU and in Redis under `auth_token:{key}`.
+The snapshot is rebuilt into a User instance with the remaining fields
+deferred, so reading any other field still works and `save()` only
+writes the fields that were loaded. Views that change the user re-fetch
+it or save with `update_fields`, a snapshot may be up to REDIS_TTL
+seconds old.
+
+Saving a user and deleting a token (logout) evict the Redis entries once
+the transaction commits, and publish the eviction on AUTH_CHANNEL so
+every other daphne or worker process drops its local copy as well, like
+utils.app_settings does for the settings rows. An eviction also leaves a
+tombstone for TOMBSTONE_TTL seconds; a lookup that read the database
+before the eviction and fills the cache after it is refused by the
+tombstone instead of caching its stale snapshot.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import User
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+AUTH_CHANNEL = "auth_token_invalidation"
+REDIS_TTL = 300
+LOCAL_TTL = 10
+LOCAL_MAX_SIZE = 10000
+TOMBSTONE_TTL = 5
+
+SNAPSHOT_FIELDS = (
+    "id", "username", "first_name", "last_name", "email", "user_type", "type", "on_duty",
+    "is_active", "is_staff", "is_superuser", "is_driver_admin", "is_verified", "verification_status",
+    "remark", "device_id", "phone_number", "driver_pic", "added_by_id",
+)
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+# Bumped by every local eviction, a lookup started before one does not
+# store its result locally
+_generation = 0
+_listener = None
+_listener_lock = threading.Lock()
+
+# KEYS: auth_token:{key}, auth_user_tokens:{user_id},
+#       auth_user_evicted:{user_id}, auth_token_evicted:{key}
+# ARGV: snapshot, ttl, token key
+FILL_TOKEN = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[3], KEYS[4]) > 0 then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2], 'NX')
+redis.call('SADD', KEYS[2], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+""")
+
+
+def token_cache_key(key):
+    return f"auth_token:{key}"
+
+
+def user_tokens_key(user_id):
+    return f"auth_user_tokens:{user_id}"
+
+
+def user_tombstone_key(user_id):
+    return f"auth_user_evicted:{user_id}"
+
+
+def token_tombstone_key(key):
+    return f"auth_token_evicted:{key}"
+
+
+def get_token_user(key):
+    """
+    Returns the user owning token `key`, or None for an unknown token.
+    """
+    _start_listener()
+    values = _local_get(key)
+    if values is None:
+        generation = _generation
+        cacheable = True
+        try:
+            cached = redis_client.get(token_cache_key(key))
+        except redis.RedisError:
+            cached = None
+        if cached is not None:
+            values = json.loads(cached)
+        else:
+            try:
+                token = Token.objects.select_related("user").get(key=key)
+            except Token.DoesNotExist:
+                return None
+            values = _snapshot(token.user)
+            try:
+                cacheable = bool(FILL_TOKEN(
+                    keys=[
+                        token_cache_key(key), user_tokens_key(token.user_id),
+                        user_tombstone_key(token.user_id), token_tombstone_key(key),
+                    ],
+                    args=[json.dumps(values), REDIS_TTL, key],
+                    client=redis_client,
+                ))
+            except redis.RedisError:
+                pass
+        if cacheable:
+            _local_set(key, values, generation)
+
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db("default", field_names, [values[name] for name in field_names])
+
+
+def evict_token(key):
+    """
+    Drops token `key` from every cache level of every process.
+    """
+    _evict_local_token(key)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(token_tombstone_key(key), 1, ex=TOMBSTONE_TTL)
+    pipe.delete(token_cache_key(key))
+    pipe.publish(AUTH_CHANNEL, f"token:{key}")
+    pipe.execute()
+
+
+def evict_user_tokens(user_id):
+    """
+    Drops every cached token of the user from every process.
+    """
+    _evict_local_user(user_id)
+    # The tombstone goes first, a fill that lands after it is refused and
+    # one that landed before it is in the token set deleted below
+    redis_client.set(user_tombstone_key(user_id), 1, ex=TOMBSTONE_TTL)
+    keys = redis_client.smembers(user_tokens_key(user_id))
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.delete(user_tokens_key(user_id), *[token_cache_key(key) for key in keys])
+    pipe.publish(AUTH_CHANNEL, f"user:{user_id}")
+    pipe.execute()
+
+
+def _evict_local_token(key):
+    global _generation
+    with _local_lock:
+        _generation += 1
+        _local.pop(key, None)
+
+
+def _evict_local_user(user_id):
+    global _generation
+    with _local_lock:
+        _generation += 1
+        for key in [key for key, (_, values) in _local.items() if values["id"] == user_id]:
+            del _local[key]
+
+
+def _evict_local_all():
+    global _generation
+    with _local_lock:
+        _generation += 1
+        _local.clear()
+
+
+def _start_listener():
+    global _listener
+    if _listener is not None:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name="auth-token-invalidation", daemon=True)
+            _listener.start()
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(AUTH_CHANNEL)
+            # Anything published while we were not subscribed is lost
+            _evict_local_all()
+            for message in pubsub.listen():
+                kind, _, value = message["data"].partition(":")
+                if kind == "user":
+                    _evict_local_user(int(value))
+                elif kind == "token":
+                    _evict_local_token(value)
+        except redis.RedisError as e:
+            print("[ERROR] Auth token invalidation listener:", str(e))
+            time.sleep(1)
+
+
+def _snapshot(user):
+    return {
+        name: User._meta.get_field(name).get_prep_value(getattr(user, name))
+        for name in SNAPSHOT_FIELDS
+    }
+
+
+def _local_get(key):
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _local[key]
+            return None
+        _local.move_to_end(key)
+        return entry[1]
+
+
+def _local_set(key, values, generation):
+    with _local_lock:
+        if generation != _generation:
+            return
+        _local[key] = (time.monotonic() + LOCAL_TTL, values)
+        _local.move_to_end(key)
+        while len(_local) > LOCAL_MAX_SIZE:
+            _local.popitem(last=False)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for TokenAuthentication that resolves tokens
+    through get_token_user() instead of a database join per request.
+    """
+
+    def authenticate_credentials(self, key):
+        user = get_token_user(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        token = Token(key=key, user_id=user.pk)
+        token.user = user
+        return (user, token)
+
+
+def _evict_user_tokens_on_commit(user_id):
+    try:
+        evict_user_tokens(user_id)
+    except redis.RedisError as e:
+        print("[ERROR] Failed evicting cached tokens of user", user_id, str(e))
+
+
+def _evict_token_on_commit(key):
+    try:
+        evict_token(key)
+    except redis.RedisError as e:
+        print("[ERROR] Failed evicting cached token:", str(e))
+
+
+@receiver(post_save, sender=User)
+def evict_saved_user(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: _evict_user_tokens_on_commit(user_id))
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: _evict_token_on_commit(key))
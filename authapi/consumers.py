@@ -1,17 +1,19 @@
+import asyncio
 import json
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .models import User
-from rest_framework.authtoken.models import Token
 from .utils import get_key_from_cookies
+from .authentication import get_token_user
+from .throttling import LocationThrottle
 import urllib.parse
 
 from driveradmin.models import create_status_history
-from django.conf import settings
-import redis
-
-pool = redis.ConnectionPool.from_url(settings.REDIS_URL, decode_responses=True)
-redis_client = redis.Redis(connection_pool=pool)
+from utils.locations import (
+    CUSTOMERS_LOCATIONS, adriver_connected, adriver_disconnected, aremove_driver_location, async_redis_client,
+)
+from utils.location_writer import location_writer
 
 
 class UserLocationConsumer(AsyncWebsocketConsumer):
@@ -40,12 +42,13 @@ class UserLocationConsumer(AsyncWebsocketConsumer):
         if self.user.user_type == 'driver' and self.user.type:
             self.room_drivers = f'drivers_{self.user.type}'
             await self.channel_layer.group_add(self.room_drivers, self.channel_name)
+            await adriver_connected(self.user.username, self.user.type, self.user.on_duty)
             user_status = "on" if self.user.on_duty else "off"
             create_status_history(user=self.user, status="online", user_status=user_status)
             try:
                 print("[DEBUG] Getting admin username")
                 admin_username = await get_admin_username(self.user)
-                redis_client.set(f"driver_admin:{self.user.username}", admin_username)
+                await async_redis_client.set(f"driver_admin:{self.user.username}", admin_username)
                 print(f"[DEBUG] admin_username = {admin_username}")
             except Exception as e:
                 print("[ERROR] Failed getting admin_username:", str(e))
@@ -66,17 +69,28 @@ class UserLocationConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+        self.location_throttle = LocationThrottle()
+        if self.location_throttle.window:
+            self.location_ticker = asyncio.create_task(self.forward_locations())
+
     async def disconnect(self, close_code):
         """
         Handles WebSocket disconnection.
         - Removes the driver from the room group.
         - Marks the driver as offline in the database.
         """
+        if hasattr(self, 'location_ticker'):
+            self.location_ticker.cancel()
+
+        if hasattr(self, 'location_throttle'):
+            await self.location_throttle.flush_stats()
+
         if hasattr(self, 'room_user'):
             await self.channel_layer.group_discard(self.room_user, self.channel_name)
 
         if hasattr(self, 'room_drivers'):
             await self.channel_layer.group_discard(self.room_drivers, self.channel_name)
+            await adriver_disconnected(self.user.username, self.user.type)
 
         if hasattr(self, 'room_customers'):
             await self.channel_layer.group_discard(self.room_customers, self.channel_name)
@@ -84,11 +98,11 @@ class UserLocationConsumer(AsyncWebsocketConsumer):
         if self.user.user_type == 'driver':
             user_status = "on" if self.user.on_duty else "off"
             create_status_history(user=self.user, status="offline", user_status=user_status)
-            redis_client.delete(f"driver_admin:{self.user.username}")
+            await async_redis_client.delete(f"driver_admin:{self.user.username}")
 
 
         # This is turned off for now        
-        # self.remove_driver_from_redis(self.user.username, self.user.user_type)
+        # await self.remove_driver_from_redis(self.user.username, self.user.user_type)
 
         print(f'Driver disconnected. Close code: {close_code}')
 
@@ -101,39 +115,66 @@ class UserLocationConsumer(AsyncWebsocketConsumer):
             if latitude is None or longitude is None:
                 raise ValueError("Latitude and longitude are required.")
 
-            await self.update_user_location(self.user.username, latitude, longitude, self.user.user_type)
-
-            if self.user.user_type == "driver":
-                customer_username = redis_client.get(f"{self.user.username}_has_customer")
-                if customer_username:
-                    await self.send_location_update(customer_username, latitude, longitude, "driver")
-                
-                admin_username = redis_client.get(f"driver_admin:{self.user.username}")
-                if admin_username:
-                    print(admin_username)
-                    await self.channel_layer.group_send(
-                        f"admin_{admin_username}",
-                        {
-                            'type': 'admin_driver_location_update',
-                            'latitude': latitude,
-                            'longitude': longitude,
-                            'driver': self.user.username
-                        }
-                    )
-                location_data = json.dumps({'latitude': latitude, 'longitude': longitude})
-
-                redis_client.rpush(f"driver_location_history:{self.user.username}",location_data)
-
-            elif self.user.user_type == "customer":
-                driver_list = redis_client.get(f"{self.user.username}_has_driver")
-                if driver_list:
-                    for driver in json.loads(driver_list):
-                        await self.send_location_update(driver, latitude, longitude, "customer")
-                
-                
+            fix = self.location_throttle.offer(latitude, longitude, time.monotonic())
+            if fix:
+                await self.process_location(*fix)
         except Exception as e:
             await self.send(text_data=json.dumps({'error': str(e)}))
 
+    async def forward_locations(self, stats_interval=60):
+        """
+        Forwards the latest coalesced fix once per throttle window.
+        """
+        last_flush = time.monotonic()
+        while True:
+            await asyncio.sleep(self.location_throttle.window)
+            now = time.monotonic()
+            try:
+                fix = self.location_throttle.tick(now)
+                if fix:
+                    await self.process_location(*fix)
+                if now - last_flush >= stats_interval:
+                    await self.location_throttle.flush_stats()
+                    last_flush = now
+            except Exception as e:
+                await self.send(text_data=json.dumps({'error': str(e)}))
+
+    async def process_location(self, latitude, longitude):
+        """
+        Stores a forwarded fix and relays it to the linked customer/drivers
+        and the driver's admin.
+        """
+        if self.user.user_type == "driver":
+            linked = await location_writer.write(self.user.username, self.user.type, longitude, latitude)
+            if linked is None:
+                # A newer fix from another of the driver's sockets replaced this one
+                return
+            customer_username, admin_username = linked
+            if customer_username:
+                await self.send_location_update(customer_username, latitude, longitude, "driver")
+            
+            if admin_username:
+                print(admin_username)
+                await self.channel_layer.group_send(
+                    f"admin_{admin_username}",
+                    {
+                        'type': 'admin_driver_location_update',
+                        'latitude': latitude,
+                        'longitude': longitude,
+                        'driver': self.user.username
+                    }
+                )
+
+        elif self.user.user_type == "customer":
+            pipe = async_redis_client.pipeline(transaction=False)
+            pipe.geoadd(CUSTOMERS_LOCATIONS, (longitude, latitude, self.user.username))
+            pipe.get(f"{self.user.username}_has_driver")
+            _, driver_list = await pipe.execute()
+            if driver_list:
+                for driver in json.loads(driver_list):
+                    await self.send_location_update(driver, latitude, longitude, "customer")
+
+
     async def send_location_update(self, username, latitude, longitude, sender_type):
         await self.channel_layer.group_send(
             f"user_{username}",
@@ -186,34 +227,24 @@ class UserLocationConsumer(AsyncWebsocketConsumer):
         driver_username = event['driver']['username']
         customer_username = event['customer']['username']
 
-        existing_drivers = redis_client.get(f"{customer_username}_has_driver")
+        existing_drivers = await async_redis_client.get(f"{customer_username}_has_driver")
         # This block is written to give user option to book multiple cars
         if existing_drivers:
             drivers_list = json.loads(existing_drivers)
             if driver_username not in drivers_list:
                 drivers_list.append(driver_username)
-            redis_client.set(f"{customer_username}_has_driver", json.dumps(drivers_list))
+            await async_redis_client.set(f"{customer_username}_has_driver", json.dumps(drivers_list))
         else:
-            redis_client.set(f"{customer_username}_has_driver", json.dumps([driver_username]))
+            await async_redis_client.set(f"{customer_username}_has_driver", json.dumps([driver_username]))
         
-        redis_client.set(f"{driver_username}_has_customer", customer_username)
+        await async_redis_client.set(f"{driver_username}_has_customer", customer_username)
 
         await self.send(text_data=json.dumps(event))
         
     @database_sync_to_async
     def authenticate_user(self, user_id,token):
-        try:
-            tkn = Token.objects.get(key=token)
-            return tkn.user if user_id == tkn.user.username else None
-        except Token.DoesNotExist:
-            return None
-
-    @database_sync_to_async
-    def update_user_location(self, username, latitude, longitude, type):
-        if type == "customer":
-            redis_client.geoadd("customers_locations", (longitude, latitude, username))
-        elif type == "driver":
-            redis_client.geoadd("drivers_locations", (longitude, latitude, username))
+        user = get_token_user(token)
+        return user if user and user_id == user.username else None
 
     @database_sync_to_async
     def mark_user_offline(self, driver_id):
@@ -233,14 +264,14 @@ class UserLocationConsumer(AsyncWebsocketConsumer):
         query_params = urllib.parse.parse_qs(query_string)
         return query_params.get('token', [None])[0]
 
-    def remove_driver_from_redis(self, username, type):
+    async def remove_driver_from_redis(self, username, type):
         """
         Removes a driver from Redis when they disconnect.
         """
         if type == "customer":
-            redis_client.zrem("customers_locations", username)
+            await async_redis_client.zrem(CUSTOMERS_LOCATIONS, username)
         elif type == "driver":
-            redis_client.zrem("drivers_locations", username)
+            await aremove_driver_location(username, self.user.type)
 
 @database_sync_to_async
 def get_admin_username(user):
@@ -0,0 +1,110 @@
+import asyncio
+import multiprocessing
+import time
+
+from channels.layers import DEFAULT_CHANNEL_LAYER, channel_layers
+from django.core.management.base import BaseCommand
+
+
+def run_worker(index, connections, groups, ready, stop, delivered):
+    """
+    Stands in for one ASGI worker: holds `connections` channels, each in one
+    of the benchmark groups, and counts the messages they receive.
+    """
+    asyncio.run(hold_connections(index, connections, groups, ready, stop, delivered))
+
+
+async def hold_connections(index, connections, groups, ready, stop, delivered):
+    layer = channel_layers.make_backend(DEFAULT_CHANNEL_LAYER)
+    channels = [await layer.new_channel() for _ in range(connections)]
+    for i, channel in enumerate(channels):
+        await layer.group_add(f"bench_group_{i % groups}", channel)
+    ready.release()
+
+    received = 0
+
+    async def consume(channel):
+        nonlocal received
+        while True:
+            await layer.receive(channel)
+            received += 1
+
+    tasks = [asyncio.create_task(consume(channel)) for channel in channels]
+    while not stop.is_set():
+        delivered[index] = received
+        await asyncio.sleep(0.1)
+    delivered[index] = received
+
+    for task in tasks:
+        task.cancel()
+    for i, channel in enumerate(channels):
+        await layer.group_discard(f"bench_group_{i % groups}", channel)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures group_send throughput of the configured channel layer with 1..N worker processes, "
+        "each holding a share of the WebSocket-like channels."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+        parser.add_argument("--connections", type=int, default=500, help="Channels held by each worker.")
+        parser.add_argument("--groups", type=int, default=50)
+        parser.add_argument("--messages", type=int, default=2000, help="group_send calls per run.")
+        parser.add_argument("--timeout", type=float, default=60)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'workers':>7} {'conns':>7} {'sends/s':>9} {'delivered':>10} {'deliveries/s':>13}"
+        )
+        for workers in options["workers"]:
+            self.run_case(workers, options)
+
+    def run_case(self, workers, options):
+        context = multiprocessing.get_context("spawn")
+        ready = context.Semaphore(0)
+        stop = context.Event()
+        delivered = context.Array("q", workers)
+        processes = [
+            context.Process(target=run_worker, args=(
+                index, options["connections"], options["groups"], ready, stop, delivered,
+            ))
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.acquire()
+
+        members = workers * options["connections"]
+        expected = options["messages"] * members // options["groups"]
+        send_seconds, total_seconds = asyncio.run(
+            self.send(options["messages"], options["groups"], delivered, expected, options["timeout"])
+        )
+
+        stop.set()
+        for process in processes:
+            process.join()
+
+        total = sum(delivered)
+        self.stdout.write(
+            f"{workers:>7} {members:>7} {options['messages'] / send_seconds:>9.0f} "
+            f"{total:>10} {total / total_seconds:>13.0f}"
+        )
+        if total < expected:
+            self.stdout.write(self.style.WARNING(
+                f"  {expected - total} of {expected} deliveries missing, raise CHANNEL_LAYER_CAPACITY"
+            ))
+
+    async def send(self, messages, groups, delivered, expected, timeout):
+        layer = channel_layers.make_backend(DEFAULT_CHANNEL_LAYER)
+        started = time.perf_counter()
+        for i in range(messages):
+            await layer.group_send(f"bench_group_{i % groups}", {"type": "bench.message", "n": i})
+        send_seconds = time.perf_counter() - started
+
+        deadline = started + timeout
+        while sum(delivered) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        return send_seconds, time.perf_counter() - started
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import statistics
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+import redis
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import path
+from rest_framework.authtoken.models import Token
+
+from authapi.consumers import UserLocationConsumer
+from authapi.models import User
+from orders.management.commands.simulate_dispatch import ASYNC_REDIS_CLIENTS, REDIS_CLIENTS, random_point
+from utils.locations import location_history_key, remove_driver_location
+
+
+class BenchmarkConsumer(UserLocationConsumer):
+    """
+    UserLocationConsumer that records how long each frame took from the
+    client send until its handling finished.
+    """
+    latencies = []
+
+    async def receive(self, text_data):
+        await super().receive(text_data)
+        self.latencies.append(time.perf_counter() - json.loads(text_data)["sent_at"])
+
+
+class BlockingRedis:
+    """
+    Async facade that runs every command on a blocking client inside the
+    event loop, which is how the consumer talked to Redis before it moved
+    to redis.asyncio. Used as the --blocking baseline.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def pipeline(self, *args, **kwargs):
+        return BlockingPipeline(self.client.pipeline(*args, **kwargs))
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            return command(*args, **kwargs)
+        return call
+
+
+class BlockingPipeline:
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    async def execute(self):
+        return self.pipe.execute()
+
+
+class Command(BaseCommand):
+    help = (
+        "Connects N driver sockets to UserLocationConsumer in this process and has each send location "
+        "updates at a fixed rate. Reports the handled rate, frame latency and event loop lag per socket "
+        "count; a count is sustained when every frame is handled within one update interval. Run once "
+        "with --blocking to get the numbers for the old blocking Redis client. The test clients share "
+        "the event loop with the consumers, so absolute numbers are a lower bound."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", nargs="+", type=int, default=[100, 500, 1000])
+        parser.add_argument("--rate", type=float, default=1, help="Location updates per socket per second.")
+        parser.add_argument("--duration", type=float, default=10, help="Seconds of updates per socket count.")
+        parser.add_argument("--blocking", action="store_true",
+                            help="Run the consumer's Redis calls on the blocking client, as before redis.asyncio.")
+        parser.add_argument("--fakeredis", action="store_true", help="Use fakeredis instead of settings.REDIS_URL.")
+
+    def handle(self, *args, **options):
+        with ExitStack() as stack:
+            if options["fakeredis"]:
+                try:
+                    import fakeredis
+                except ImportError:
+                    raise CommandError("--fakeredis needs the fakeredis package (pip install fakeredis).")
+                server = fakeredis.FakeServer()
+                sync_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+                async_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+                for client in REDIS_CLIENTS:
+                    stack.enter_context(mock.patch(client, sync_client))
+                stack.enter_context(mock.patch("utils.geo_shards.shard_clients", [sync_client]))
+            else:
+                sync_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+                async_client = None
+
+            if options["blocking"]:
+                async_client = BlockingRedis(sync_client)
+            if async_client is not None:
+                for client in ASYNC_REDIS_CLIENTS:
+                    stack.enter_context(mock.patch(client, async_client))
+                stack.enter_context(mock.patch("utils.geo_shards.async_shard_clients", [async_client]))
+
+            # Every frame goes through to Redis, the throttle is measured elsewhere
+            stack.enter_context(override_settings(
+                CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+                LOCATION_MIN_INTERVAL=0, LOCATION_MIN_DISTANCE=0, LOCATION_COALESCE_WINDOW=0,
+            ))
+
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                drivers, tokens = self.seed(max(options["sockets"]))
+                self.stdout.write(
+                    f"{'sockets':>7} {'target/s':>9} {'handled/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+                    f"{'loop lag ms':>12} {'sustained':>10}"
+                )
+                try:
+                    # One event loop for every case, the shared asyncio pool is bound to it
+                    asyncio.run(self.run_cases(drivers, tokens, options))
+                finally:
+                    for driver in drivers:
+                        remove_driver_location(driver.username, driver.type)
+                        sync_client.delete(location_history_key(driver.username))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, count):
+        admin = User.objects.create(username="bench_admin", user_type="driver", is_driver_admin=True)
+        drivers = User.objects.bulk_create([
+            User(username=f"bench_driver_{i}", user_type="driver", type="0", on_duty=True, added_by=admin)
+            for i in range(count)
+        ])
+        Token.objects.bulk_create([Token(user=driver, key=Token.generate_key()) for driver in drivers])
+        return drivers, dict(Token.objects.filter(user__in=drivers).values_list("user_id", "key"))
+
+    async def run_cases(self, drivers, tokens, options):
+        for sockets in options["sockets"]:
+            await self.run_case(drivers[:sockets], tokens, options)
+
+    async def run_case(self, drivers, tokens, options):
+        BenchmarkConsumer.latencies = []
+        application = URLRouter([path("ws/user/<str:user_id>/", BenchmarkConsumer.as_asgi())])
+        communicators = []
+        for driver in drivers:
+            communicator = WebsocketCommunicator(application, f"/ws/user/{driver.username}/?token={tokens[driver.id]}")
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError(f"Driver {driver.username} could not connect")
+            communicators.append(communicator)
+
+        interval = 1 / options["rate"]
+        updates = int(options["duration"] * options["rate"])
+        lags = []
+
+        async def send_updates(index, communicator):
+            # Spread the sockets evenly over one interval
+            await asyncio.sleep(interval * index / len(communicators))
+            for _ in range(updates):
+                latitude, longitude = random_point(5)
+                await communicator.send_json_to({
+                    "latitude": latitude, "longitude": longitude, "sent_at": time.perf_counter(),
+                })
+                await asyncio.sleep(interval)
+
+        async def watch_loop():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - started - 0.01)
+
+        watcher = asyncio.create_task(watch_loop())
+        started = time.perf_counter()
+        await asyncio.gather(*(send_updates(i, communicator) for i, communicator in enumerate(communicators)))
+        expected = updates * len(communicators)
+        deadline = time.perf_counter() + max(5, interval * 2)
+        while len(BenchmarkConsumer.latencies) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        watcher.cancel()
+
+        for communicator in communicators:
+            await communicator.disconnect()
+
+        latencies = sorted(BenchmarkConsumer.latencies)
+        handled = len(latencies)
+        p50 = statistics.median(latencies) * 1000 if latencies else float("nan")
+        p99 = latencies[max(int(handled * 0.99) - 1, 0)] * 1000 if latencies else float("nan")
+        sustained = handled >= expected and p99 < interval * 1000
+        self.stdout.write(
+            f"{len(communicators):>7} {len(communicators) * options['rate']:>9.0f} {handled / elapsed:>10.0f} "
+            f"{p50:>8.1f} {p99:>8.1f} {max(lags, default=0) * 1000:>12.1f} {'yes' if sustained else 'no':>10}"
+        )
@@ -0,0 +1,78 @@
+from django.conf import settings
+
+from utils.locations import async_redis_client, distance_m
+
+# Process-wide totals are added to this hash, see LocationThrottle.flush_stats
+LOCATION_FRAMES_STATS = "location_frames"
+
+
+class LocationThrottle:
+    """
+    Per-connection policy deciding which GPS frames are forwarded.
+
+    With a coalescing window, frames only replace the pending fix and the
+    consumer calls `tick()` once per window to forward the latest one; any
+    fix replaced before its tick counts as dropped. A fix is also dropped
+    when it comes less than `min_interval` seconds after, or less than
+    `min_distance` meters away from, the last forwarded one, unless
+    nothing was forwarded for `max_silence` seconds.
+    """
+
+    def __init__(self, min_interval=None, min_distance=None, window=None, max_silence=None):
+        self.min_interval = settings.LOCATION_MIN_INTERVAL if min_interval is None else min_interval
+        self.min_distance = settings.LOCATION_MIN_DISTANCE if min_distance is None else min_distance
+        self.window = settings.LOCATION_COALESCE_WINDOW if window is None else window
+        self.max_silence = settings.LOCATION_MAX_SILENCE if max_silence is None else max_silence
+
+        self.pending = None
+        self.last = None
+        self.received = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self._flushed = (0, 0, 0)
+
+    def offer(self, latitude, longitude, now):
+        """
+        Returns the fix to forward right away, or None when it was dropped
+        or is held for the next tick.
+        """
+        self.received += 1
+        if self.window:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = (latitude, longitude)
+            return None
+        return self._accept(latitude, longitude, now)
+
+    def tick(self, now):
+        if self.pending is None:
+            return None
+        latitude, longitude = self.pending
+        self.pending = None
+        return self._accept(latitude, longitude, now)
+
+    def _accept(self, latitude, longitude, now):
+        if self.last is not None:
+            last_time, last_latitude, last_longitude = self.last
+            if now - last_time < self.max_silence and (
+                now - last_time < self.min_interval
+                or distance_m(last_latitude, last_longitude, latitude, longitude) < self.min_distance
+            ):
+                self.dropped += 1
+                return None
+        self.last = (now, latitude, longitude)
+        self.forwarded += 1
+        return latitude, longitude
+
+    async def flush_stats(self):
+        """
+        Adds the counts since the previous flush to the shared stats hash.
+        """
+        received, forwarded, dropped = self._flushed
+        # Taken before awaiting so a concurrent flush cannot count twice
+        self._flushed = (self.received, self.forwarded, self.dropped)
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.hincrby(LOCATION_FRAMES_STATS, "received", self.received - received)
+        pipe.hincrby(LOCATION_FRAMES_STATS, "forwarded", self.forwarded - forwarded)
+        pipe.hincrby(LOCATION_FRAMES_STATS, "dropped", self.dropped - dropped)
+        await pipe.execute()
@@ -10,6 +10,8 @@ from .models import User,EmailGroupModel,CarPic
 from .utils import generate_unique_username
 from django.utils.crypto import get_random_string
 from django.shortcuts import render,HttpResponse
+from utils.locations import set_driver_on_duty
+from django.db import transaction
 
 class RegisterAPIView(APIView):
     permission_classes = [AllowAny]
@@ -216,7 +218,8 @@ class LogoutAPIView(APIView):
             print(request.auth.key, request.user.device_id)
             token = Token.objects.get(key=request.auth.key)
             request.user.device_id = None
-            request.user.save()
+            # request.user may be a cached snapshot, only write what changed
+            request.user.save(update_fields=["device_id"])
             token.delete()
 
             return Response(
@@ -410,17 +413,20 @@ class OnDutyToggleView(APIView):
                 ), status=status.HTTP_400_BAD_REQUEST,
             )
             
-            # Toggle the on_duty status
-            user = request.user
-            user.on_duty = not user.on_duty 
             from driveradmin.models import UserOnDutyHistory
-            user_status =  'on' if user.on_duty else 'off'
-            try:
-                UserOnDutyHistory.objects.create(user=user,status=user_status)
-            except:
-                return Response(data_response(400,"Bad Request",{"message": "Try Again"}), status=status.HTTP_400_BAD_REQUEST)
-
-            user.save()
+            with transaction.atomic():
+                # Toggle the on_duty status of the stored row, request.user
+                # may be a cached snapshot a few seconds old
+                user = User.objects.select_for_update().get(pk=request.user.pk)
+                user.on_duty = not user.on_duty 
+                user_status =  'on' if user.on_duty else 'off'
+                try:
+                    UserOnDutyHistory.objects.create(user=user,status=user_status)
+                except:
+                    return Response(data_response(400,"Bad Request",{"message": "Try Again"}), status=status.HTTP_400_BAD_REQUEST)
+
+                user.save(update_fields=["on_duty"])
+            set_driver_on_duty(user.username, user.type, user.on_duty)
 
             return Response(data_response(200,"Ok",{"message": 'on' if user.on_duty else 'off'}), status=status.HTTP_200_OK)
         
@@ -149,7 +149,7 @@ DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL")
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authapi.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -163,16 +163,68 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 CORS_ALLOW_ALL_ORIGINS = True 
 CORS_ALLOW_CREDENTIALS = True
 
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = 0
+REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
+# Size of the per-process redis.asyncio pool shared by the WebSocket consumers
+REDIS_ASYNC_MAX_CONNECTIONS = int(os.getenv("REDIS_ASYNC_MAX_CONNECTIONS", 50))
+
+# Every daphne process and dispatch worker shares this layer, so any of them
+# can group_send to sockets held by another one behind nginx.
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {
+            "hosts": [REDIS_URL],
+            # Messages waiting per channel before new ones are dropped
+            "capacity": int(os.getenv("CHANNEL_LAYER_CAPACITY", 1500)),
+            # Seconds an undelivered message is kept
+            "expiry": 10,
+            # Group memberships of sockets from a crashed worker expire after a day
+            "group_expiry": 86400,
+        },
     }
 }
 
-REDIS_HOST = "redis"
-REDIS_PORT = 6379
-REDIS_DB = 0
-REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
+# Per-connection policy for incoming GPS frames, see authapi/throttling.py.
+# Seconds and meters; a window of 0 forwards frames as they arrive.
+LOCATION_MIN_INTERVAL = float(os.getenv("LOCATION_MIN_INTERVAL", 1))
+LOCATION_MIN_DISTANCE = float(os.getenv("LOCATION_MIN_DISTANCE", 5))
+LOCATION_COALESCE_WINDOW = float(os.getenv("LOCATION_COALESCE_WINDOW", 1))
+LOCATION_MAX_SILENCE = float(os.getenv("LOCATION_MAX_SILENCE", 30))
+# Write-behind of driver fixes, see utils/location_writer.py. Milliseconds;
+# a flush interval of 0 writes every fix as it arrives.
+LOCATION_FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", 100))
+LOCATION_MAX_STALENESS = float(os.getenv("LOCATION_MAX_STALENESS", 5000))
+# Cap of each driver's location_history stream, in entries and seconds
+LOCATION_HISTORY_MAXLEN = int(os.getenv("LOCATION_HISTORY_MAXLEN", 86400))
+LOCATION_HISTORY_RETENTION = float(os.getenv("LOCATION_HISTORY_RETENTION", 24 * 60 * 60))
+LOCATION_HISTORY_SIMPLIFY_CACHE_TTL = int(os.getenv("LOCATION_HISTORY_SIMPLIFY_CACHE_TTL", 300))
+# History older than LOCATION_ARCHIVE_AFTER seconds is moved from Redis to
+# segment files here by the archive_location_history command
+LOCATION_ARCHIVE_DIR = os.getenv("LOCATION_ARCHIVE_DIR", os.path.join(BASE_DIR, 'location_archive'))
+LOCATION_ARCHIVE_AFTER = float(os.getenv("LOCATION_ARCHIVE_AFTER", 60 * 60))
+# Geohash precision the dispatch geo keys are sharded by, 0 keeps one key per
+# type, see utils/geo_shards.py. Cells are spread over GEO_SHARD_REDIS_URLS
+# (comma separated), REDIS_URL when unset.
+GEO_SHARD_PRECISION = int(os.getenv("GEO_SHARD_PRECISION", 0))
+GEO_SHARD_REDIS_URLS = [url for url in os.getenv("GEO_SHARD_REDIS_URLS", "").split(",") if url] or [REDIS_URL]
+# Where dispatch looks for drivers: "redis" searches the geo keys, "memory" an
+# index every dispatch worker keeps from the dispatch_updates stream, see
+# utils/spatial_index.py. The stream has to hold more than location_max_age
+# of updates for a restarted worker to see the whole fleet.
+DISPATCH_SEARCH_BACKEND = os.getenv("DISPATCH_SEARCH_BACKEND", "redis")
+DISPATCH_UPDATES_MAXLEN = int(os.getenv("DISPATCH_UPDATES_MAXLEN", 100000))
+# Ranking of drivers when ApplicationSettings.offers_per_request is set, see
+# orders/scoring.py. The acceptance rate counts offers of the last N days.
+DISPATCH_SCORE_WEIGHTS = {"distance": 0.4, "freshness": 0.2, "type": 0.25, "acceptance": 0.15}
+DISPATCH_ACCEPTANCE_WINDOW = int(os.getenv("DISPATCH_ACCEPTANCE_WINDOW", 7))
+# Seconds the driver admin dashboard's fleet snapshot is cached per admin
+DASHBOARD_SNAPSHOT_TTL = int(os.getenv("DASHBOARD_SNAPSHOT_TTL", 5))
+# Seconds a user's current trip stays cached for the car request list, see
+# orders/trip_state.py
+CURRENT_TRIP_TTL = int(os.getenv("CURRENT_TRIP_TTL", 60 * 60))
 
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -1,6 +1,6 @@
 # views.py
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 import json
 from django.shortcuts import render
 from django.contrib.auth import authenticate, login
@@ -13,11 +13,21 @@ from authapi.models import User
 from django.conf import settings
 from rest_framework.authtoken.models import Token
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+import math
+import re
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from utils.locations import aiter_location_history, driver_positions, read_location_history, read_location_history_page
+from utils.path_simplification import read_simplified_location_history
 
 pool = redis.ConnectionPool.from_url(settings.REDIS_URL, decode_responses=True)
 redis_client = redis.Redis(connection_pool=pool)
 
+HISTORY_PAGE_SIZE = 1000
+HISTORY_PAGE_MAX = 10000
+HISTORY_CURSOR = re.compile(r"^\d+-\d+$")
+
 
 def login_view(request):
     if request.method == "POST":
@@ -38,26 +48,38 @@ def login_view(request):
 
 @login_required(login_url='zora_login')
 def dashboard_view(request):
-    admin = request.user
-    drivers_queryset = User.objects.filter(user_type="driver", added_by=admin)
+    drivers_json = dashboard_snapshot(request.user)
+    tkn,_ =  Token.objects.get_or_create(user=request.user)
+    return render(request, 'dashboard/index.html', {"drivers_json": drivers_json,"token":tkn})
 
 
+def dashboard_snapshot(admin):
+    """
+    JSON list of the admin's drivers that have a position, as the dashboard
+    map renders them. Cached per admin for DASHBOARD_SNAPSHOT_TTL seconds.
+    """
+    cache_key = f"dashboard_snapshot:{admin.id}"
+    cached = redis_client.get(cache_key)
+    if cached is not None:
+        return cached
+
+    drivers_queryset = User.objects.filter(user_type="driver", added_by=admin).only("id", "username")
+
     # Get latest status and duty status per driver using subqueries
     latest_statuses = UserStatusHistory.objects.filter(user=OuterRef('pk')).order_by('-timestamp')
     latest_duties = UserOnDutyHistory.objects.filter(user=OuterRef('pk')).order_by('-timestamp')
 
-    drivers = []
-
-    for driver in drivers_queryset.annotate(
+    annotated = list(drivers_queryset.annotate(
         latest_status=Subquery(latest_statuses.values('status')[:1]),
         latest_user_status=Subquery(latest_statuses.values('user_status')[:1]),
         latest_duty=Subquery(latest_duties.values('status')[:1])
-    ):
-        # Get location from Redis
-        location = redis_client.geopos("drivers_locations", driver.username)
+    ))
+    positions = driver_positions([driver.username for driver in annotated])
 
-        if location and location[0]:
-            lng, lat = location[0]
+    drivers = []
+    for driver in annotated:
+        if driver.username in positions:
+            lng, lat = positions[driver.username]
 
             drivers.append({
                 "id": driver.id,
@@ -68,9 +90,8 @@ def dashboard_view(request):
                 "dutyStatus": "On Duty" if driver.latest_duty == "on" else "Off Duty"
             })
     drivers_json = json.dumps(drivers)
-    print(drivers_json)
-    tkn,_ =  Token.objects.get_or_create(user=request.user)
-    return render(request, 'dashboard/index.html', {"drivers_json": drivers_json,"token":tkn})
+    redis_client.set(cache_key, drivers_json, ex=settings.DASHBOARD_SNAPSHOT_TTL)
+    return drivers_json
 
 
 @login_required(login_url='zora_login')
@@ -110,22 +131,70 @@ def driver_view(request):
 
 
 
+def parse_history_time(value):
+    """
+    Epoch milliseconds for a `since` / `until` query param, None when absent.
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = None
+    if seconds is not None:
+        # inf / nan, and timestamps past what a datetime holds, e.g. 1e300
+        if not math.isfinite(seconds):
+            raise ValueError(f"Invalid timestamp: {value}")
+        try:
+            datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError(f"Invalid timestamp: {value}")
+        return int(seconds * 1000)
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return int(parsed.timestamp() * 1000)
+
+
+def parse_simplification(request):
+    """
+    `tolerance` (meters) and `zoom` query params, both None for the raw path.
+    """
+    tolerance = request.GET.get("tolerance")
+    tolerance = float(tolerance) if tolerance else None
+    zoom = request.GET.get("zoom")
+    zoom = int(zoom) if zoom else None
+    if tolerance is not None and not 0 <= tolerance < math.inf:
+        raise ValueError(f"Invalid tolerance: {tolerance}")
+    if zoom is not None and not 0 <= zoom <= 24:
+        raise ValueError(f"Invalid zoom: {zoom}")
+    return tolerance, zoom
+
+
 @csrf_exempt
 @login_required(login_url='zora_login')
 def get_location_history(request, username):
     """
     API to fetch the location history of a user from Redis.
+    Optional `since` / `until` query params limit it to a time window, as
+    unix timestamps or ISO 8601 datetimes. With `tolerance` (meters) or
+    `zoom` (map zoom level) the path comes back simplified.
     Always returns 200 OK with empty data if no history is found.
     """
     try:
-        # Fetch the location history list for the user from Redis
-        location_history = redis_client.lrange(f"driver_location_history:{username}", 0, -1)
+        since = parse_history_time(request.GET.get("since"))
+        until = parse_history_time(request.GET.get("until"))
+        tolerance, zoom = parse_simplification(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-        # Convert to Python dicts (if data exists)
-        if location_history:
-            location_history = [json.loads(item) for item in location_history]
+    try:
+        if tolerance is not None or zoom is not None:
+            location_history = read_simplified_location_history(username, since, until, tolerance, zoom)
         else:
-            location_history = []
+            location_history = read_location_history(username, since, until)
 
         # Prepare the response data
         response_data = {
@@ -136,4 +205,64 @@ def get_location_history(request, username):
         return JsonResponse(response_data, status=200)
 
     except Exception as e:
-        return JsonResponse({"error": str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@login_required(login_url='zora_login')
+def get_location_history_page(request, username):
+    """
+    Cursor-paginated get_location_history, archived history included,
+    `limit` entries per page.
+    Pass the returned `next_cursor` as `cursor` to get the following page,
+    it is null on the last one.
+    """
+    try:
+        since = parse_history_time(request.GET.get("since"))
+        until = parse_history_time(request.GET.get("until"))
+        limit = min(max(int(request.GET.get("limit", HISTORY_PAGE_SIZE)), 1), HISTORY_PAGE_MAX)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    cursor = request.GET.get("cursor")
+    if cursor and not HISTORY_CURSOR.match(cursor):
+        return JsonResponse({"error": f"Invalid cursor: {cursor}"}, status=400)
+
+    try:
+        location_history, next_cursor = read_location_history_page(username, since, until, cursor, limit)
+        return JsonResponse({
+            "username": username,
+            "location_history": location_history,
+            "next_cursor": next_cursor,
+        }, status=200)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@csrf_exempt
+@login_required(login_url='zora_login')
+def stream_location_history(request, username):
+    """
+    get_location_history as NDJSON, one entry per line. Entries are sent
+    as they are read from Redis in slices, so the client can start drawing
+    before the whole history has arrived. `tolerance` / `zoom` stream the
+    simplified path instead.
+    """
+    try:
+        since = parse_history_time(request.GET.get("since"))
+        until = parse_history_time(request.GET.get("until"))
+        tolerance, zoom = parse_simplification(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # An async iterator, Django would buffer a sync one in full under ASGI
+    async def lines():
+        if tolerance is not None or zoom is not None:
+            entries = await sync_to_async(read_simplified_location_history)(username, since, until, tolerance, zoom)
+            yield "".join(json.dumps(entry) + "\n" for entry in entries)
+            return
+        async for entries in aiter_location_history(username, since, until, HISTORY_PAGE_SIZE):
+            yield "".join(json.dumps(entry) + "\n" for entry in entries)
+
+    return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
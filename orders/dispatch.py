@@ -0,0 +1,248 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from authapi.models import User
+from utils.locations import last_seen, search_available_drivers
+from utils.notifications import send_expo_notification
+from .dispatch_queue import schedule_dispatch_wave
+from .models import CustomerRequest, CustomerRequestDriverMapping, REQUEST_TYPE_TO_CAR_TYPE
+from .scoring import score_candidates, top_candidates
+
+async def group_send_many(channel_layer, groups, event):
+    """
+    Sends the same event to several groups in one event-loop round trip.
+    """
+    for group in groups:
+        await channel_layer.group_send(group, event)
+
+
+def dispatch_car_type(car_request, app_settings):
+    """
+    User.type to search, None for every available driver. Only set when
+    send_request_to is 'type'.
+    """
+    send_request_to = app_settings.send_request_to if app_settings else 'all'
+    if send_request_to == 'type':
+        return REQUEST_TYPE_TO_CAR_TYPE[car_request.request_type]
+    return None
+
+
+def location_max_age(app_settings, max_age=None):
+    """
+    Seconds a driver's last fix may be old to be dispatched, 0 for any age.
+    """
+    if max_age is not None:
+        return max_age
+    return app_settings.location_max_age if app_settings else 120
+
+
+def dispatch_request(car_request, app_settings, wave=0, max_age=None):
+    """
+    Entry point used by the dispatch workers, picks the strategy configured
+    in ApplicationSettings.dispatch_mode. `max_age` overrides
+    ApplicationSettings.location_max_age.
+    """
+    dispatch_mode = app_settings.dispatch_mode if app_settings else 'all'
+    if dispatch_mode == 'nearest':
+        return send_request_to_nearest_drivers(car_request, app_settings, wave, max_age)
+    return send_request_to_nearby_drivers(car_request, app_settings, max_age)
+
+
+def send_request_to_nearby_drivers(car_request, app_settings, max_age=None):
+    """
+    Finds nearby drivers based on settings and sends WebSocket event.
+    Also, stores the request-driver mapping for future updates.
+
+    Drivers are loaded in one query, mappings are written with one
+    bulk insert and a single push notification is sent per dispatch.
+    With ApplicationSettings.offers_per_request set only that many
+    drivers get the request, the best scored ones.
+    """
+    radius_km = app_settings.search_radius if app_settings else 10  
+    max_age = location_max_age(app_settings, max_age)
+    car_type = dispatch_car_type(car_request, app_settings)
+    limit = app_settings.offers_per_request if app_settings else 0
+
+    if limit:
+        drivers = best_scored_drivers(car_request, car_type, radius_km, max_age, limit)
+    else:
+        nearby_drivers = search_available_drivers(
+            car_type, float(car_request.longitude), float(car_request.latitude), radius_km, max_age=max_age,
+        )
+        drivers = load_drivers(nearby_drivers)
+    offer_request_to_drivers(car_request, drivers)
+    return drivers
+
+
+def best_scored_drivers(car_request, car_type, radius_km, max_age, count):
+    """
+    The `count` drivers in radius with the best orders.scoring score, best
+    first. Drivers whose last fix is older than `max_age` are skipped.
+    """
+    found = search_available_drivers(
+        car_type, float(car_request.longitude), float(car_request.latitude), radius_km, withdist=True,
+    )
+    if not found:
+        return []
+    distances = dict(found)
+    usernames = list(distances)
+    seen = dict(zip(usernames, last_seen(usernames)))
+    drivers = load_scoring_candidates(
+        usernames, timezone.now() - timedelta(days=settings.DISPATCH_ACCEPTANCE_WINDOW)
+    )
+    if not drivers:
+        return []
+
+    # None becomes NaN, an unknown age
+    ages = (time.time() * 1000 - np.array([seen[driver.username] for driver in drivers], dtype=np.float64)) / 1000
+    candidates = np.flatnonzero(ages <= max_age) if max_age else np.arange(len(drivers))
+    requested_type = REQUEST_TYPE_TO_CAR_TYPE[car_request.request_type]
+    scores = score_candidates(
+        np.array([distances[driver.username] for driver in drivers])[candidates],
+        ages[candidates],
+        np.array([driver.type == requested_type for driver in drivers])[candidates],
+        np.array([driver.recent_offers for driver in drivers])[candidates],
+        np.array([driver.recent_accepts for driver in drivers])[candidates],
+        radius_km,
+        max_age or 120,
+    )
+    return [drivers[i] for i in candidates[top_candidates(scores, count)]]
+
+
+def send_request_to_nearest_drivers(car_request, app_settings, wave=0, max_age=None):
+    """
+    Offers the request to the nearest `drivers_per_wave` drivers that have
+    not seen it yet. Wave n searches (n + 1) / `dispatch_waves` of the
+    search radius, so the ring widens until it covers `search_radius`. When a wave
+    goes out the next one is scheduled `wave_timeout` seconds later; the
+    worker drops it if a driver accepted in the meantime.
+    """
+    radius_km = app_settings.search_radius if app_settings else 10
+    per_wave = app_settings.drivers_per_wave if app_settings else 5
+    waves = max(app_settings.dispatch_waves if app_settings else 3, 1)
+    timeout = app_settings.wave_timeout if app_settings else 20
+    max_age = location_max_age(app_settings, max_age)
+
+    car_type = dispatch_car_type(car_request, app_settings)
+    offered = set(
+        CustomerRequestDriverMapping.objects.filter(request=car_request)
+        .values_list("driver__username", flat=True)
+    )
+
+    while wave < waves:
+        nearest = search_available_drivers(
+            car_type, float(car_request.longitude), float(car_request.latitude),
+            radius_km * (wave + 1) / waves, count=per_wave + len(offered), max_age=max_age,
+        )
+        candidates = [username for username in nearest if username not in offered]
+        drivers = load_drivers(candidates[:per_wave])
+        if drivers:
+            offer_request_to_drivers(car_request, drivers)
+            if wave + 1 < waves:
+                schedule_dispatch_wave(car_request.id, wave + 1, timeout)
+            return drivers
+        # Nobody new in this ring, widen straight away
+        wave += 1
+
+    return []
+
+
+def load_drivers(usernames):
+    """
+    Loads the drivers for `usernames` in one query, keeping the order of
+    `usernames` (nearest first when it comes from a sorted geo search).
+    """
+    if not usernames:
+        return []
+
+    drivers = User.objects.filter(username__in=usernames, user_type='driver').only("id", "username", "device_id")
+    by_username = {driver.username: driver for driver in drivers}
+    return [by_username[username] for username in usernames if username in by_username]
+
+
+def load_scoring_candidates(usernames, since):
+    """
+    load_drivers plus each driver's type and how many offers they got and
+    accepted since `since`, in one query.
+    """
+    if not usernames:
+        return []
+
+    recent = Q(customerrequestdrivermapping__created_at__gte=since)
+    drivers = (
+        User.objects.filter(username__in=usernames, user_type='driver')
+        .only("id", "username", "device_id", "type")
+        .annotate(
+            recent_offers=Count("customerrequestdrivermapping", filter=recent),
+            recent_accepts=Count(
+                "customerrequestdrivermapping", filter=recent & Q(customerrequestdrivermapping__status="accepted")
+            ),
+        )
+    )
+    by_username = {driver.username: driver for driver in drivers}
+    return [by_username[username] for username in usernames if username in by_username]
+
+
+def offer_request_to_drivers(car_request, drivers):
+    """
+    Stores the request-driver mappings, sends the booking event to every
+    driver socket and a single push notification for the whole batch.
+    """
+    if not drivers:
+        return
+
+    CustomerRequestDriverMapping.objects.bulk_create(
+        [CustomerRequestDriverMapping(request=car_request, driver=driver) for driver in drivers],
+        ignore_conflicts=True,
+    )
+
+    latitude = car_request.latitude
+    longitude = car_request.longitude
+    request_type_dict = dict(CustomerRequest.REQUEST_TYPES)
+    request_type_name = request_type_dict.get(car_request.request_type, "Unknown")
+    customer = car_request.customer
+    customer_name = customer.get_full_name()
+    timestamp = car_request.timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    location = {"lat": float(latitude), "lon": float(longitude)}
+
+    event = {
+        "type": "new_booking_event",
+        "event": "new",
+        "id": car_request.id,
+        "booking_type": "booking",
+        "data": {
+            "user": {"name": customer_name, "phone": str(customer.phone_number)},
+            "request_type": request_type_name, 
+            "location": location,
+            "status": car_request.status,
+            "timestamp": timestamp,
+            "additional_details": car_request.additional_details or "",
+        },
+    }
+
+    async_to_sync(group_send_many)(
+        get_channel_layer(), [f"user_{driver.username}" for driver in drivers], event
+    )
+
+    fcm_tokens = [driver.device_id for driver in drivers if driver.device_id]
+    if fcm_tokens:
+        send_expo_notification(
+            to=fcm_tokens,
+            title=f'{car_request.get_request_type_display()} needed!',
+            body=f"{car_request.get_request_type_display()} request from {customer_name}",
+            data={
+                "request_id": car_request.id,
+                "request_type": request_type_name,
+                "location": location,
+                "status": car_request.status,
+                "timestamp": timestamp,
+                "additional_details": car_request.additional_details or "",
+            }
+        )
@@ -0,0 +1,89 @@
+"""
+Redis Streams work queue for car request dispatch.
+
+`CustomerCarRequestView` only appends the new request id to the stream.
+`manage.py dispatch_worker` processes read it through a consumer group, so
+any number of workers can share the load and a message stays pending until
+a worker acknowledges it (at-least-once delivery).
+
+Follow-up waves of the nearest-first dispatch mode wait in the
+DISPATCH_WAVES sorted set, scored by due time, until a worker moves them
+onto the stream.
+"""
+import time
+
+import redis
+from django.conf import settings
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+DISPATCH_STREAM = "dispatch_requests"
+DISPATCH_GROUP = "dispatch_workers"
+DISPATCH_WAVES = "dispatch_waves"
+# Approximate cap on stream length, acknowledged entries are trimmed first
+DISPATCH_STREAM_MAXLEN = 100000
+
+
+def enqueue_dispatch(request_id, wave=0):
+    return redis_client.xadd(
+        DISPATCH_STREAM, {"request_id": request_id, "wave": wave},
+        maxlen=DISPATCH_STREAM_MAXLEN, approximate=True,
+    )
+
+
+def schedule_dispatch_wave(request_id, wave, delay_seconds):
+    redis_client.zadd(DISPATCH_WAVES, {f"{request_id}:{wave}": time.time() + delay_seconds})
+
+
+def enqueue_due_waves(limit=100):
+    """
+    Moves waves whose timeout expired onto the stream. ZREM decides which
+    worker owns a wave, so each one is enqueued once however many workers poll.
+    """
+    enqueued = 0
+    for member in redis_client.zrangebyscore(DISPATCH_WAVES, 0, time.time(), start=0, num=limit):
+        if redis_client.zrem(DISPATCH_WAVES, member):
+            request_id, wave = member.split(":")
+            enqueue_dispatch(request_id, int(wave))
+            enqueued += 1
+    return enqueued
+
+
+def ensure_consumer_group():
+    try:
+        redis_client.xgroup_create(DISPATCH_STREAM, DISPATCH_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def read_dispatches(consumer, count=10, block_ms=5000):
+    """
+    Returns up to `count` new (message_id, fields) pairs for this consumer.
+    """
+    response = redis_client.xreadgroup(
+        DISPATCH_GROUP, consumer, {DISPATCH_STREAM: ">"}, count=count, block=block_ms
+    )
+    return response[0][1] if response else []
+
+
+def claim_stale_dispatches(consumer, min_idle_ms, count=10):
+    """
+    Takes over messages another worker read but never acknowledged,
+    e.g. because it crashed mid-dispatch.
+    """
+    response = redis_client.xautoclaim(
+        DISPATCH_STREAM, DISPATCH_GROUP, consumer, min_idle_ms, start_id="0-0", count=count
+    )
+    return [(message_id, fields) for message_id, fields in response[1] if fields]
+
+
+def delivery_count(message_id):
+    pending = redis_client.xpending_range(
+        DISPATCH_STREAM, DISPATCH_GROUP, min=message_id, max=message_id, count=1
+    )
+    return pending[0]["times_delivered"] if pending else 0
+
+
+def ack_dispatch(message_id):
+    redis_client.xack(DISPATCH_STREAM, DISPATCH_GROUP, message_id)
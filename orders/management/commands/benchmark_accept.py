@@ -0,0 +1,119 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from authapi.models import User
+from orders.models import CustomerRequest, CustomerRequestDriverMapping
+from orders.management.commands.simulate_dispatch import REDIS_CLIENTS
+from orders import trip_state
+from orders.trip_state import current_trip_key
+from orders.views import DriverAcceptRequestView
+from utils.locations import remove_driver_location
+
+
+class Command(BaseCommand):
+    help = (
+        "Fires concurrent accepts at one request and checks that exactly one driver wins. Runs against a "
+        "throwaway test database; without --fakeredis it writes to settings.REDIS_URL and needs DEBUG on."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", type=int, default=200)
+        parser.add_argument("--fakeredis", action="store_true", help="Use fakeredis instead of settings.REDIS_URL.")
+
+    def handle(self, *args, **options):
+        if not options["fakeredis"] and not settings.DEBUG:
+            raise CommandError("Refusing to write benchmark data to settings.REDIS_URL with DEBUG off, pass --fakeredis.")
+
+        with ExitStack() as stack:
+            if options["fakeredis"]:
+                try:
+                    import fakeredis
+                except ImportError:
+                    raise CommandError("--fakeredis needs the fakeredis package (pip install fakeredis).")
+                fake_client = fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+                for client in REDIS_CLIENTS:
+                    stack.enter_context(mock.patch(client, fake_client))
+                stack.enter_context(mock.patch("utils.geo_shards.shard_clients", [fake_client]))
+                stack.enter_context(override_settings(
+                    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+                ))
+
+            if connection.vendor == "sqlite":
+                # The in-memory test database locks tables against concurrent
+                # writers instead of waiting, use a file
+                test_settings = connection.settings_dict.setdefault("TEST", {})
+                stack.enter_context(mock.patch.dict(test_settings, {
+                    "NAME": os.path.join(tempfile.gettempdir(), "benchmark_accept.sqlite3"),
+                }))
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.run(options["drivers"])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, count):
+        customer = User.objects.create(username="bench_accept_customer", user_type="customer")
+        drivers = User.objects.bulk_create([
+            User(username=f"bench_accept_driver_{i}", user_type="driver", type="0") for i in range(count)
+        ])
+        car_request = CustomerRequest.objects.create(customer=customer, request_type="0", latitude=0, longitude=0)
+        CustomerRequestDriverMapping.objects.bulk_create([
+            CustomerRequestDriverMapping(request=car_request, driver=driver) for driver in drivers
+        ])
+
+        factory = APIRequestFactory()
+        view = DriverAcceptRequestView.as_view()
+        barrier = threading.Barrier(count)
+
+        def accept(driver):
+            request = factory.post(f"/request-api/accept-request/{car_request.id}/")
+            force_authenticate(request, user=driver)
+            barrier.wait()
+            started = time.perf_counter()
+            try:
+                response = view(request, request_id=car_request.id)
+                return response.status_code, (time.perf_counter() - started) * 1000
+            finally:
+                connection.close()
+
+        try:
+            with mock.patch("orders.views.send_expo_notification"):
+                with ThreadPoolExecutor(max_workers=count) as executor:
+                    results = list(executor.map(accept, drivers))
+
+            codes = [code for code, _ in results]
+            timings = sorted(timing for _, timing in results)
+            winners = codes.count(200)
+            car_request.refresh_from_db()
+            accepted = CustomerRequestDriverMapping.objects.filter(request=car_request, status="accepted").count()
+
+            self.stdout.write(f"accepts: {count}, 200: {winners}, 409: {codes.count(409)}, other: {count - winners - codes.count(409)}")
+            self.stdout.write(f"accepted mappings: {accepted}, assigned driver: {car_request.driver}")
+            self.stdout.write(
+                f"p50 {statistics.median(timings):.2f} ms, "
+                f"p99 {timings[max(int(len(timings) * 0.99) - 1, 0)]:.2f} ms, max {timings[-1]:.2f} ms"
+            )
+            if winners == 1 and accepted == 1:
+                self.stdout.write(self.style.SUCCESS("Exactly one winner"))
+            else:
+                self.stdout.write(self.style.ERROR("Expected exactly one winner"))
+        finally:
+            for driver in drivers:
+                remove_driver_location(driver.username, driver.type)
+            # The winning accept saved the current trip of the customer and its driver,
+            # through the module so --fakeredis applies
+            trip_state.redis_client.delete(*[current_trip_key(user.id) for user in [customer, *drivers]])
+            customer.delete()
+            User.objects.filter(id__in=[driver.id for driver in drivers]).delete()
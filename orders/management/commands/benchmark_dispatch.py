@@ -0,0 +1,115 @@
+import random
+import statistics
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from authapi.models import User
+from orders.models import CustomerRequest
+from utils.locations import driver_connected, remove_driver_location, update_driver_location
+from utils.spatial_index import driver_index
+from utils.models import ApplicationSettings
+from orders.dispatch import dispatch_request
+from orders.management.commands.simulate_dispatch import REDIS_CLIENTS
+
+CENTER_LAT = 19.0760
+CENTER_LON = 72.8777
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures dispatch latency for a request with 10, 100 and 1,000 drivers in range. Runs against a "
+        "throwaway test database; without --fakeredis it writes to settings.REDIS_URL and needs DEBUG on."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", nargs="+", type=int, default=[10, 100, 1000])
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--mode", choices=["all", "nearest"], default="all",
+                            help="ApplicationSettings.dispatch_mode to benchmark.")
+        parser.add_argument("--backend", choices=["redis", "memory"], default=settings.DISPATCH_SEARCH_BACKEND,
+                            help="DISPATCH_SEARCH_BACKEND to benchmark.")
+        parser.add_argument("--offers", type=int, default=0,
+                            help="ApplicationSettings.offers_per_request to benchmark, 0 offers every driver.")
+        parser.add_argument("--fakeredis", action="store_true", help="Use fakeredis instead of settings.REDIS_URL.")
+
+    def handle(self, *args, **options):
+        if not options["fakeredis"] and not settings.DEBUG:
+            raise CommandError("Refusing to write benchmark data to settings.REDIS_URL with DEBUG off, pass --fakeredis.")
+
+        with ExitStack() as stack:
+            if options["fakeredis"]:
+                try:
+                    import fakeredis
+                except ImportError:
+                    raise CommandError("--fakeredis needs the fakeredis package (pip install fakeredis).")
+                fake_client = fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+                for client in REDIS_CLIENTS:
+                    stack.enter_context(mock.patch(client, fake_client))
+                stack.enter_context(mock.patch("utils.geo_shards.shard_clients", [fake_client]))
+                stack.enter_context(override_settings(
+                    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+                ))
+            stack.enter_context(override_settings(DISPATCH_SEARCH_BACKEND=options["backend"]))
+
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.stdout.write(f"{'drivers':>8} {'p50 ms':>9} {'max ms':>9} {'queries':>8} {'pushes':>7}")
+                for count in options["drivers"]:
+                    self.run_case(count, options["repeat"], ApplicationSettings(
+                        dispatch_mode=options["mode"], offers_per_request=options["offers"],
+                    ))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_case(self, count, repeat, app_settings):
+        usernames = [f"bench_driver_{i}" for i in range(count)]
+        pushes = []
+        timings = []
+        queries = 0
+
+        try:
+            with transaction.atomic():
+                customer = User.objects.create(username="bench_customer", user_type="customer")
+                User.objects.bulk_create([
+                    User(username=username, user_type="driver", type="0", device_id=f"ExponentPushToken[{username}]")
+                    for username in usernames
+                ])
+                # Scatter the fleet within ~2 km of the request
+                for username in usernames:
+                    driver_connected(username, "0", on_duty=True)
+                    update_driver_location(
+                        username, "0",
+                        CENTER_LON + random.uniform(-0.02, 0.02),
+                        CENTER_LAT + random.uniform(-0.02, 0.02),
+                    )
+                if settings.DISPATCH_SEARCH_BACKEND == "memory":
+                    driver_index.start()
+                    driver_index.catch_up()
+
+                with mock.patch("orders.dispatch.send_expo_notification", side_effect=lambda **kw: pushes.append(kw)), \
+                        mock.patch("orders.dispatch.schedule_dispatch_wave"):
+                    for _ in range(repeat):
+                        car_request = CustomerRequest.objects.create(
+                            customer=customer, request_type="0", latitude=CENTER_LAT, longitude=CENTER_LON,
+                        )
+                        with CaptureQueriesContext(connection) as ctx:
+                            started = time.perf_counter()
+                            dispatch_request(car_request, app_settings)
+                            timings.append((time.perf_counter() - started) * 1000)
+                        queries = len(ctx.captured_queries)
+
+                transaction.set_rollback(True)
+        finally:
+            for username in usernames:
+                remove_driver_location(username, "0")
+
+        self.stdout.write(
+            f"{count:>8} {statistics.median(timings):>9.2f} {max(timings):>9.2f} "
+            f"{queries:>8} {len(pushes) // repeat:>7}"
+        )
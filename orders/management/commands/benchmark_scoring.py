@@ -0,0 +1,38 @@
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from orders.scoring import score_candidates, top_candidates
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures orders.scoring on synthetic candidate batches: scoring every candidate and picking the "
+        "best N, without the geo search and database load around it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--candidates", nargs="+", type=int, default=[100, 1000, 5000, 20000])
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(1)
+        self.stdout.write(f"{'candidates':>10} {'p50 ms':>9} {'max ms':>9}")
+        for count in options["candidates"]:
+            distances = rng.uniform(0, 10, count)
+            ages = rng.uniform(0, 120, count)
+            ages[rng.random(count) < 0.01] = np.nan
+            type_matches = rng.random(count) < 0.5
+            offers = rng.integers(0, 50, count)
+            accepted = rng.binomial(offers, 0.3)
+
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                scores = score_candidates(distances, ages, type_matches, offers, accepted, 10, 120)
+                top_candidates(scores, options["top"])
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f"{count:>10} {statistics.median(timings):>9.3f} {max(timings):>9.3f}")
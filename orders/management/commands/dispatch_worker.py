@@ -0,0 +1,85 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from authapi.models import User
+from orders.dispatch import dispatch_request, location_max_age
+from orders.dispatch_queue import (
+    ack_dispatch, claim_stale_dispatches, delivery_count, enqueue_due_waves, ensure_consumer_group,
+    read_dispatches,
+)
+from orders.models import CustomerRequest
+from utils.app_settings import get_application_settings
+from utils import spatial_index
+from utils.locations import evict_stale_drivers
+
+
+class Command(BaseCommand):
+    help = "Consumes the dispatch stream and sends car requests to nearby drivers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--consumer", default=f"{socket.gethostname()}-{os.getpid()}",
+                            help="Consumer name inside the group, must be unique per worker.")
+        parser.add_argument("--batch", type=int, default=10)
+        parser.add_argument("--block", type=int, default=1000,
+                            help="Milliseconds to wait for new messages, also the dispatch wave polling interval.")
+        parser.add_argument("--claim-idle", type=int, default=30000,
+                            help="Milliseconds before another worker's unacknowledged message is retried.")
+        parser.add_argument("--max-deliveries", type=int, default=5)
+        parser.add_argument("--sweep-interval", type=float, default=30,
+                            help="Seconds between evictions of drivers without a recent location update.")
+
+    def handle(self, *args, **options):
+        consumer = options["consumer"]
+        ensure_consumer_group()
+        if spatial_index.enabled():
+            spatial_index.driver_index.start()
+            self.stdout.write(f"Dispatch index loaded with {len(spatial_index.driver_index)} drivers")
+        self.stdout.write(f"Dispatch worker {consumer} started")
+        last_sweep = 0
+
+        while True:
+            if time.monotonic() - last_sweep >= options["sweep_interval"]:
+                self.sweep()
+                last_sweep = time.monotonic()
+            enqueue_due_waves()
+            messages = claim_stale_dispatches(consumer, options["claim_idle"], options["batch"])
+            messages += read_dispatches(consumer, options["batch"], options["block"])
+            for message_id, fields in messages:
+                close_old_connections()
+                self.process(message_id, fields, options["max_deliveries"])
+
+    def sweep(self):
+        """
+        Drops drivers whose last fix is older than location_max_age from the
+        dispatch keys, so searches stop finding phones that went quiet.
+        """
+        close_old_connections()
+        max_age = location_max_age(get_application_settings())
+        if max_age:
+            evicted = evict_stale_drivers(max_age, [car_type for car_type, _ in User.CAR_TYPE_CHOICES])
+            if evicted:
+                self.stdout.write(f"Evicted {evicted} stale drivers")
+
+    def process(self, message_id, fields, max_deliveries):
+        try:
+            car_request = CustomerRequest.objects.select_related("customer").get(id=fields.get("request_id"))
+        except (CustomerRequest.DoesNotExist, ValueError):
+            ack_dispatch(message_id)
+            return
+
+        # Requests accepted or canceled while queued need no fan-out
+        if car_request.status == "pending":
+            try:
+                dispatch_request(car_request, get_application_settings(), int(fields.get("wave", 0)))
+            except Exception as e:
+                deliveries = delivery_count(message_id)
+                self.stderr.write(f"Dispatch of request {car_request.id} failed ({deliveries}): {e}")
+                if deliveries < max_deliveries:
+                    # Left pending, picked up again after --claim-idle
+                    return
+
+        ack_dispatch(message_id)
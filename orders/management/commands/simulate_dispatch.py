@@ -0,0 +1,279 @@
+import asyncio
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from django.urls import path
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from authapi.consumers import UserLocationConsumer
+from authapi.models import User
+from orders.dispatch import dispatch_request
+from orders.models import CustomerRequest
+from orders.views import CustomerCarRequestView, DriverAcceptRequestView
+from utils import locations
+from utils.app_settings import get_application_settings
+from utils.models import ApplicationSettings
+
+CENTER_LAT = 19.0760
+CENTER_LON = 72.8777
+
+# Module level clients swapped for fakeredis with --fakeredis
+REDIS_CLIENTS = [
+    "authapi.authentication.redis_client",
+    "orders.dispatch_queue.redis_client",
+    "orders.trip_state.redis_client",
+    "orders.views.redis_client",
+    "utils.app_settings.redis_client",
+    "utils.path_simplification.redis_client",
+    "utils.spatial_index.redis_client",
+    "utils.locations.redis_client",
+]
+ASYNC_REDIS_CLIENTS = [
+    "authapi.consumers.async_redis_client",
+    "authapi.throttling.async_redis_client",
+    "utils.location_writer.async_redis_client",
+    "utils.locations.async_redis_client",
+]
+
+
+class QueryCounter:
+    """
+    Counts queries on every database connection, including the ones opened
+    by sync_to_async worker threads.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class SimulatedConsumer(UserLocationConsumer):
+    """
+    UserLocationConsumer that records every frame it sends.
+    """
+    frames = []
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if text_data is not None:
+            self.frames.append((time.perf_counter(), self.user.username, json.loads(text_data)))
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+
+def random_point(spread_km):
+    """
+    Uniform point within `spread_km` of the simulation center.
+    """
+    distance = spread_km * math.sqrt(random.random())
+    bearing = random.uniform(0, 2 * math.pi)
+    lat = CENTER_LAT + (distance / 111.32) * math.cos(bearing)
+    lon = CENTER_LON + (distance / (111.32 * math.cos(math.radians(CENTER_LAT)))) * math.sin(bearing)
+    return lat, lon
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a synthetic driver fleet, connects every driver through UserLocationConsumer and fires "
+        "concurrent request-car calls. Reports time-to-first-offer, time-to-accept, DB queries and frames sent. "
+        "Runs against a throwaway test database and an in-memory channel layer; dispatch runs inline "
+        "instead of through the dispatch workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", type=int, default=200)
+        parser.add_argument("--requests", type=int, default=20)
+        parser.add_argument("--spread-km", type=float, default=5, help="Radius the fleet and requests are spread over.")
+        parser.add_argument("--mode", choices=["all", "nearest"], default="all",
+                            help="ApplicationSettings.dispatch_mode to simulate.")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--fakeredis", action="store_true", help="Use fakeredis instead of settings.REDIS_URL.")
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        SimulatedConsumer.frames = []
+        self.pushes = 0
+        self.enqueued = []
+
+        with ExitStack() as stack:
+            if options["fakeredis"]:
+                try:
+                    import fakeredis
+                except ImportError:
+                    raise CommandError("--fakeredis needs the fakeredis package (pip install fakeredis).")
+                server = fakeredis.FakeServer()
+                fake_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+                fake_async_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+                for client in REDIS_CLIENTS:
+                    stack.enter_context(mock.patch(client, fake_client))
+                for client in ASYNC_REDIS_CLIENTS:
+                    stack.enter_context(mock.patch(client, fake_async_client))
+                stack.enter_context(mock.patch("utils.geo_shards.shard_clients", [fake_client]))
+                stack.enter_context(mock.patch("utils.geo_shards.async_shard_clients", [fake_async_client]))
+
+            stack.enter_context(override_settings(
+                CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+            ))
+            stack.enter_context(mock.patch("orders.dispatch.send_expo_notification", side_effect=self.count_push))
+            stack.enter_context(mock.patch("orders.views.send_expo_notification", side_effect=self.count_push))
+            stack.enter_context(mock.patch("orders.views.enqueue_dispatch", side_effect=self.enqueued.append))
+            # Waves are timer driven and out of scope for a single pass
+            stack.enter_context(mock.patch("orders.dispatch.schedule_dispatch_wave"))
+
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                asyncio.run(self.simulate(options))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def count_push(self, **kwargs):
+        self.pushes += 1
+
+    async def simulate(self, options):
+        drivers, customers, tokens = await self.seed(options)
+        # SQLite cannot take concurrent writers, run the views on one thread there
+        run_view = lambda view: sync_to_async(view, thread_sensitive=connection.vendor == "sqlite")
+
+        application = URLRouter([path("ws/user/<str:user_id>/", SimulatedConsumer.as_asgi())])
+        communicators = []
+        for driver in drivers:
+            communicator = WebsocketCommunicator(application, f"/ws/user/{driver.username}/?token={tokens[driver.id]}")
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError(f"Driver {driver.username} could not connect")
+            communicators.append(communicator)
+
+        for communicator in communicators:
+            latitude, longitude = random_point(options["spread_km"])
+            await communicator.send_json_to({"latitude": latitude, "longitude": longitude})
+        await self.wait_for_fleet(len(drivers))
+
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        await database_sync_to_async(counter.install)(connection=connection)
+        SimulatedConsumer.frames.clear()
+
+        factory = APIRequestFactory()
+        create_view = CustomerCarRequestView.as_view()
+        accept_view = DriverAcceptRequestView.as_view()
+
+        async def request_car(customer):
+            latitude, longitude = random_point(options["spread_km"])
+            request = factory.post("/request-api/request-car/", {
+                "request_type": "0", "latitude": latitude, "longitude": longitude,
+            }, format="json")
+            force_authenticate(request, user=customer)
+            started = time.perf_counter()
+            response = await run_view(create_view)(request)
+            return response.data["data"]["id"], started
+
+        started_at = dict(await asyncio.gather(*(request_car(customer) for customer in customers)))
+        app_settings = await database_sync_to_async(get_application_settings)()
+
+        async def dispatch(request_id):
+            car_request = await database_sync_to_async(
+                CustomerRequest.objects.select_related("customer").get
+            )(id=request_id)
+            await run_view(dispatch_request)(car_request, app_settings)
+
+        await asyncio.gather(*(dispatch(request_id) for request_id in self.enqueued))
+        await self.settle()
+
+        first_offer = {}
+        for sent_at, username, frame in SimulatedConsumer.frames:
+            if frame.get("type") == "new_booking_event" and frame["id"] not in first_offer:
+                first_offer[frame["id"]] = (sent_at, username)
+
+        drivers_by_username = {driver.username: driver for driver in drivers}
+
+        async def accept(request_id):
+            _, username = first_offer[request_id]
+            request = factory.post(f"/request-api/accept-request/{request_id}/")
+            force_authenticate(request, user=drivers_by_username[username])
+            response = await run_view(accept_view)(request, request_id=request_id)
+            return request_id, response.status_code, time.perf_counter()
+
+        accepted = await asyncio.gather(*(accept(request_id) for request_id in first_offer))
+        await self.settle()
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        connection_created.disconnect(counter.install)
+
+        self.report(options, started_at, first_offer, accepted, counter.count)
+
+    @database_sync_to_async
+    def seed(self, options):
+        ApplicationSettings.objects.create(dispatch_mode=options["mode"], search_radius=math.ceil(options["spread_km"] * 2))
+        admin = User.objects.create(username="sim_admin", user_type="driver", is_driver_admin=True)
+        drivers = User.objects.bulk_create([
+            User(username=f"sim_driver_{i}", user_type="driver", type="0", on_duty=True, added_by=admin)
+            for i in range(options["drivers"])
+        ])
+        customers = User.objects.bulk_create([
+            User(username=f"sim_customer_{i}", user_type="customer")
+            for i in range(options["requests"])
+        ])
+        Token.objects.bulk_create([Token(user=driver, key=Token.generate_key()) for driver in drivers])
+        tokens = dict(Token.objects.filter(user__in=drivers).values_list("user_id", "key"))
+        return drivers, customers, tokens
+
+    async def settle(self, quiet=0.2, timeout=30):
+        """
+        Waits until the consumers stop sending frames.
+        """
+        deadline = time.perf_counter() + timeout
+        seen = -1
+        while seen != len(SimulatedConsumer.frames) and time.perf_counter() < deadline:
+            seen = len(SimulatedConsumer.frames)
+            await asyncio.sleep(quiet)
+
+    async def wait_for_fleet(self, count, timeout=10):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if await database_sync_to_async(locations.redis_client.zcard)(locations.DRIVERS_LAST_SEEN) >= count:
+                return
+            await asyncio.sleep(0.05)
+        raise CommandError("Timed out waiting for the fleet to report positions")
+
+    def report(self, options, started_at, first_offer, accepted, queries):
+        frames = SimulatedConsumer.frames
+        offer_ms = [(first_offer[request_id][0] - started_at[request_id]) * 1000 for request_id in first_offer]
+        accept_ms = [(done - started_at[request_id]) * 1000 for request_id, code, done in accepted if code == 200]
+        offers = sum(1 for _, _, frame in frames if frame.get("type") == "new_booking_event")
+
+        def summary(values):
+            if not values:
+                return "n/a"
+            values = sorted(values)
+            return (f"p50 {statistics.median(values):.1f} ms, "
+                    f"p95 {values[max(int(len(values) * 0.95) - 1, 0)]:.1f} ms, max {values[-1]:.1f} ms")
+
+        self.stdout.write(f"drivers: {options['drivers']}, requests: {options['requests']}, mode: {options['mode']}")
+        self.stdout.write(f"requests offered: {len(first_offer)}/{len(started_at)}, accepted: {len(accept_ms)}")
+        self.stdout.write(f"time to first offer: {summary(offer_ms)}")
+        self.stdout.write(f"time to accept: {summary(accept_ms)}")
+        self.stdout.write(f"db queries: {queries} ({queries / max(len(started_at), 1):.1f} per request)")
+        self.stdout.write(f"frames sent: {len(frames)} (offers {offers}), pushes: {self.pushes}")
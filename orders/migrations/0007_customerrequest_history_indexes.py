@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_customerrequest_otp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customerrequest',
+            index=models.Index(fields=['customer', '-timestamp', '-id'], name='orders_req_customer_hist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customerrequest',
+            index=models.Index(fields=['driver', '-timestamp', '-id'], name='orders_req_driver_hist_idx'),
+        ),
+    ]
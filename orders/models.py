@@ -1,5 +1,13 @@
 from django.db import models
 
+# CustomerRequest.request_type and User.type use different codes for the
+# same vehicles, e.g. '1' is Fire Brigade for a request but Police for a car.
+REQUEST_TYPE_TO_CAR_TYPE = {
+    '0': '0',  # Ambulance
+    '1': '2',  # Fire Brigade -> Firebrigade
+    '2': '1',  # Police
+}
+
 class CustomerRequest(models.Model):
     REQUEST_TYPES = [
         ('0', 'Ambulance'),
@@ -23,6 +31,13 @@ class CustomerRequest(models.Model):
     additional_details = models.TextField(blank=True, null=True)
     otp = models.CharField(max_length=6, blank=True, null=True)
 
+    class Meta:
+        # Keyset pagination of a user's history, see CarRequestHistoryView
+        indexes = [
+            models.Index(fields=["customer", "-timestamp", "-id"], name="orders_req_customer_hist_idx"),
+            models.Index(fields=["driver", "-timestamp", "-id"], name="orders_req_driver_hist_idx"),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.otp:
             self.otp = self.generate_otp()
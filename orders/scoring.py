@@ -0,0 +1,57 @@
+"""
+Ranking of dispatch candidates.
+
+`score_candidates` scores a whole candidate batch in one pass of NumPy
+array operations, higher is better. It is a weighted sum, with
+DISPATCH_SCORE_WEIGHTS, of four terms in [0, 1]:
+
+    distance    1 at the request, 0 at the edge of the search radius
+    freshness   1 for a fix just now, 0 once it is `horizon` seconds old
+    type        1 when the driver's User.type is the one requested
+    acceptance  share of the driver's offers in the last
+                DISPATCH_ACCEPTANCE_WINDOW days they accepted, pulled
+                towards ACCEPTANCE_PRIOR while they have few offers
+"""
+import numpy as np
+from django.conf import settings
+
+ACCEPTANCE_PRIOR = 0.5
+# Offers it takes for a driver's own rate to count as much as the prior
+ACCEPTANCE_PRIOR_WEIGHT = 5
+
+
+def score_candidates(distances, ages, type_matches, offers, accepted, radius, horizon):
+    """
+    Scores of the candidates. `distances` are in the unit of `radius`,
+    `ages` in seconds (NaN for unknown), `type_matches` booleans and
+    `offers`/`accepted` counts.
+    """
+    weights = settings.DISPATCH_SCORE_WEIGHTS
+    distances = np.asarray(distances, dtype=np.float64)
+    ages = np.asarray(ages, dtype=np.float64)
+    offers = np.asarray(offers, dtype=np.float64)
+    accepted = np.asarray(accepted, dtype=np.float64)
+
+    distance = 1 - np.clip(distances / radius, 0, 1) if radius else np.zeros_like(distances)
+    # An unknown age scores as the oldest
+    freshness = np.clip(1 - np.nan_to_num(ages, nan=horizon) / horizon, 0, 1)
+    acceptance = (accepted + ACCEPTANCE_PRIOR * ACCEPTANCE_PRIOR_WEIGHT) / (offers + ACCEPTANCE_PRIOR_WEIGHT)
+
+    return (
+        weights["distance"] * distance
+        + weights["freshness"] * freshness
+        + weights["type"] * np.asarray(type_matches, dtype=np.float64)
+        + weights["acceptance"] * acceptance
+    )
+
+
+def top_candidates(scores, count):
+    """
+    Indexes of the `count` best scores, best first. Ties keep the input
+    order, so nearest first for a sorted search.
+    """
+    scores = np.asarray(scores)
+    if count < len(scores):
+        best = np.argpartition(-scores, count - 1)[:count]
+        return best[np.lexsort((best, -scores[best]))]
+    return np.argsort(-scores, kind="stable")
@@ -1,5 +1,6 @@
 # serializers.py
 from rest_framework import serializers
+from authapi.models import User
 from .models import CustomerRequest
 
 class CustomerRequestSerializer(serializers.ModelSerializer):
@@ -13,3 +14,25 @@ class CustomerRequestSerializer(serializers.ModelSerializer):
             "name": obj.customer.username, 
             "phone": str(obj.customer.phone_number)
         }
+
+
+class RequestUserSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source="get_full_name")
+
+    class Meta:
+        model = User
+        fields = ['username', 'name']
+
+
+class CustomerRequestHistorySerializer(serializers.ModelSerializer):
+    """
+    Read-only row of CarRequestHistoryView, expects customer and driver to
+    be select_related.
+    """
+    customer = RequestUserSerializer(read_only=True)
+    driver = RequestUserSerializer(read_only=True)
+
+    class Meta:
+        model = CustomerRequest
+        fields = ['id', 'request_type', 'status', 'latitude', 'longitude', 'timestamp', 'additional_details', 'customer', 'driver']
+        read_only_fields = fields
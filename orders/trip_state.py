@@ -0,0 +1,193 @@
+"""
+Current trip of each user, denormalized into Redis for CarRequestListView.
+
+`current_trip:{user_id}` is a hash with `data`, the JSON of the user's
+current request as the list view returns it (`null` without one), and
+`driver`, the username of its driver. The view reads it together with the
+driver's position in one round-trip and without SQL.
+
+The current trip is always the user's newest request (current_request),
+whether the key is written or rebuilt. Saving or deleting a request, in
+the views or the admin, rewrites the key of its customer and driver once
+the transaction commits; the accept view claims requests with an UPDATE
+and rewrites them itself. Keys expire after CURRENT_TRIP_TTL seconds and
+are rebuilt on the next read.
+"""
+import json
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.utils.encoders import JSONEncoder
+
+from utils.locations import DRIVERS_LOCATIONS
+from .models import CustomerRequest
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+# KEYS: current_trip:{user_id}, drivers_locations
+READ_CURRENT_TRIP = redis_client.register_script("""
+local trip = redis.call('HMGET', KEYS[1], 'data', 'driver')
+if not trip[1] then
+    return false
+end
+local position = false
+if trip[2] and trip[2] ~= '' then
+    position = redis.call('GEOPOS', KEYS[2], trip[2])[1]
+end
+return {trip[1], position}
+""")
+
+# KEYS: current_trip:{user_id}
+# ARGV: data, driver, ttl in seconds
+FILL_CURRENT_TRIP = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'data', ARGV[1], 'driver', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+""")
+
+
+def current_trip_key(user_id):
+    return f"current_trip:{user_id}"
+
+
+def user_requests(user_id, is_driver):
+    """
+    Requests of the user, as the driver or as the customer, newest first.
+    """
+    if is_driver:
+        car_requests = CustomerRequest.objects.filter(driver_id=user_id)
+    else:
+        car_requests = CustomerRequest.objects.filter(customer_id=user_id)
+    return car_requests.select_related("customer", "driver").order_by("-timestamp", "-id")
+
+
+def current_request(user_id, is_driver):
+    """
+    The user's current trip, their newest request, None without any.
+    """
+    return user_requests(user_id, is_driver).first()
+
+
+def trip_data(car_request):
+    """
+    The request as CarRequestListView returns it, with the driver's
+    location left empty.
+    """
+    driver_data = {}
+    if car_request.driver:
+        driver = car_request.driver
+        driver_data = {
+            "username": driver.username,
+            "name": driver.get_full_name(),
+            "phone": str(driver.phone_number),
+            "car_type": driver.get_type_display(),
+            "profile_pic": driver.driver_pic.url if driver.driver_pic else None,
+            "location": {"lat": None, "lon": None},
+        }
+
+    return {
+        "id": car_request.id,
+        "request_type": car_request.request_type,
+        "status": car_request.status,
+        "latitude": car_request.latitude,
+        "longitude": car_request.longitude,
+        "timestamp": car_request.timestamp,
+        "additional_details": car_request.additional_details,
+        "driver": driver_data,
+        "customer": {
+            "username": car_request.customer.username,
+            "name": car_request.customer.get_full_name(),
+            "phone": str(car_request.customer.phone_number)
+        }
+    }
+
+
+def with_driver_location(trip, position):
+    """
+    Fills in the driver's location from a (longitude, latitude) GEOPOS
+    result, None when unknown.
+    """
+    if trip and trip["driver"]:
+        longitude, latitude = position or (None, None)
+        trip["driver"]["location"] = {
+            "lat": float(latitude) if latitude else None,
+            "lon": float(longitude) if longitude else None,
+        }
+    return trip
+
+
+def trip_fields(car_request):
+    """
+    (data, driver) hash fields of `car_request`, which may be None.
+    """
+    # Through DRF's encoder, so the cached response renders like the view's
+    data = json.dumps(trip_data(car_request) if car_request else None, cls=JSONEncoder)
+    driver = car_request.driver.username if car_request and car_request.driver else ""
+    return data, driver
+
+
+def store_current_trip(user_ids, car_request):
+    """
+    Makes `car_request`, which may be None, the current trip of `user_ids`.
+    Only for writers that run after a change committed, a read rebuilding
+    the key uses fill_current_trip.
+    """
+    data, driver = trip_fields(car_request)
+    pipe = redis_client.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.hset(current_trip_key(user_id), mapping={"data": data, "driver": driver})
+        pipe.expire(current_trip_key(user_id), settings.CURRENT_TRIP_TTL)
+    pipe.execute()
+
+
+def fill_current_trip(user_id, car_request):
+    """
+    Stores `car_request`, which may be None, as the user's current trip
+    unless the key exists. A writer that ran while the caller was reading
+    the database stored a newer trip than the one read.
+    """
+    data, driver = trip_fields(car_request)
+    FILL_CURRENT_TRIP(
+        keys=[current_trip_key(user_id)], args=[data, driver, settings.CURRENT_TRIP_TTL], client=redis_client,
+    )
+
+
+def save_current_trip(car_request):
+    """
+    Rewrites the current trip of the customer and the driver of
+    `car_request` after it changed.
+    """
+    store_current_trip([car_request.customer_id], current_request(car_request.customer_id, False))
+    if car_request.driver_id:
+        store_current_trip([car_request.driver_id], current_request(car_request.driver_id, True))
+
+
+def read_current_trip(user_id):
+    """
+    (found, trip) for the user, trip being the current request with the
+    driver's live location or None without one. `found` is False when the
+    key is missing and the trip has to be rebuilt.
+    """
+    reply = READ_CURRENT_TRIP(keys=[current_trip_key(user_id), DRIVERS_LOCATIONS], client=redis_client)
+    if reply is None:
+        return False, None
+    data, position = reply
+    return True, with_driver_location(json.loads(data), position)
+
+
+def _save_current_trip_on_commit(car_request):
+    try:
+        save_current_trip(car_request)
+    except redis.RedisError as e:
+        print("[ERROR] Failed saving current trip of request", car_request.pk, str(e))
+
+
+@receiver([post_save, post_delete], sender=CustomerRequest)
+def request_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: _save_current_trip_on_commit(instance))
@@ -2,16 +2,25 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
-from authapi.models import User
 from orders.models import CustomerRequest, CustomerRequestDriverMapping
-from utils.models import ApplicationSettings
-from .serializers import CustomerRequestSerializer
+from utils.app_settings import get_application_settings
+from .serializers import CustomerRequestHistorySerializer, CustomerRequestSerializer
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
 import redis
 from django.conf import settings
 from utils.response import data_response
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from utils.notifications import send_expo_notification
+from utils.locations import driver_positions, set_driver_busy
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
+from .dispatch_queue import enqueue_dispatch
+from .trip_state import (
+    current_request, fill_current_trip, read_current_trip, save_current_trip, trip_data, user_requests,
+    with_driver_location,
+)
 
 redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
 
@@ -28,7 +37,7 @@ class CustomerCarRequestView(APIView):
             )
 
         # Fetch application settings
-        app_settings = ApplicationSettings.objects.first()
+        app_settings = get_application_settings()
         max_requests = app_settings.maximum_requests_per_user if app_settings else 1
 
         # Check if user has exceeded max requests
@@ -46,7 +55,8 @@ class CustomerCarRequestView(APIView):
 
         if serializer.is_valid():
             car_request = serializer.save()
-            self.send_request_to_nearby_drivers(car_request, app_settings)
+            # Fan-out happens in the dispatch workers, see orders/dispatch.py
+            transaction.on_commit(lambda: enqueue_dispatch(car_request.id))
             return Response(
                 data_response(201, "Car request created successfully", serializer.data),
                 status=status.HTTP_201_CREATED
@@ -63,70 +73,6 @@ class CustomerCarRequestView(APIView):
             data_response(400, "Bad Request", {"errors": error_list}),
             status=status.HTTP_400_BAD_REQUEST
         )
-    
-    def send_request_to_nearby_drivers(self, car_request, app_settings):
-        """
-        Finds nearby drivers based on settings and sends WebSocket event.
-        Also, stores the request-driver mapping for future updates.
-        """
-        latitude = car_request.latitude
-        longitude = car_request.longitude
-        request_type = car_request.request_type
-        radius_km = app_settings.search_radius if app_settings else 10  
-        send_request_to = app_settings.send_request_to if app_settings else 'all'
-
-        nearby_drivers = redis_client.georadius(
-            "drivers_locations", float(longitude), float(latitude),
-            radius_km, unit="km", withcoord=False
-        )
-
-        channel_layer = get_channel_layer()
-        request_type_dict = dict(CustomerRequest.REQUEST_TYPES)
-        request_type_name = request_type_dict.get(request_type, "Unknown")
-        fcm_tokens = []
-
-        for driver_username in nearby_drivers:
-            try:
-                driver = User.objects.get(username=driver_username)
-                if send_request_to == 'type' and driver.car_type != car_request.car_type:
-                    continue
-                if driver.device_id:
-                    fcm_tokens.append(driver.device_id)
-                    
-                CustomerRequestDriverMapping.objects.create(request=car_request, driver=driver)
-            except User.DoesNotExist:
-                continue
-
-            async_to_sync(channel_layer.group_send)(
-                f"user_{driver_username}",
-                {
-                    "type": "new_booking_event",
-                    "event": "new",
-                    "id": car_request.id,
-                    "booking_type": "booking",
-                    "data": {
-                        "user": {"name": car_request.customer.get_full_name(), "phone": str(car_request.customer.phone_number)},
-                        "request_type": request_type_name, 
-                        "location": {"lat": float(latitude), "lon": float(longitude)},
-                        "status": car_request.status,
-                        "timestamp": car_request.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                        "additional_details": car_request.additional_details or "",
-                    },
-                },
-            )
-            send_expo_notification(
-                to=fcm_tokens,
-                title=f'{car_request.get_request_type_display()} needed!',
-                body=f"{car_request.get_request_type_display()} request from {car_request.customer.get_full_name()}",
-                data={
-                    "request_id": car_request.id,
-                    "request_type": request_type_name,
-                    "location": {"lat": float(latitude), "lon": float(longitude)},
-                    "status": car_request.status,
-                    "timestamp": car_request.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                    "additional_details": car_request.additional_details or "",
-                }
-            )
 
 
 class DriverAcceptRequestView(APIView):
@@ -142,22 +88,31 @@ class DriverAcceptRequestView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        try:
-            car_request = CustomerRequest.objects.get(id=request_id, status="pending")
-        except CustomerRequest.DoesNotExist:
+        # Claim the request with a single conditional UPDATE, only one of
+        # several concurrent accepts can match status="pending"
+        claimed = CustomerRequest.objects.filter(id=request_id, status="pending").update(
+            driver=driver, status="in_progress"
+        )
+        if not claimed:
+            if CustomerRequest.objects.filter(id=request_id).exists():
+                return Response(
+                    data_response(409, "Request already accepted.", {}),
+                    status=status.HTTP_409_CONFLICT
+                )
             return Response(
                 data_response(404, "Request not found or already accepted.", {}),
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Assign driver to the request
-        car_request.driver = driver
-        car_request.status = "in_progress"
-        car_request.save()
-
         # Update mapping for all drivers who received the request
-        CustomerRequestDriverMapping.objects.filter(request=car_request).update(status="ignored")
-        CustomerRequestDriverMapping.objects.filter(request=car_request, driver=driver).update(status="accepted")
+        CustomerRequestDriverMapping.objects.filter(request_id=request_id).update(
+            status=Case(When(driver=driver, then=Value("accepted")), default=Value("ignored"))
+        )
+        set_driver_busy(driver.username, driver.type, True)
+
+        car_request = CustomerRequest.objects.select_related("customer", "driver").get(id=request_id)
+        # The claim is an UPDATE, which sends no post_save
+        save_current_trip(car_request)
 
         # Notify the customer and other drivers via WebSocket
         self.notify_customer(car_request)
@@ -229,7 +184,7 @@ class DriverAcceptRequestView(APIView):
         channel_layer = get_channel_layer()
 
         # Get all drivers who received this request except the accepted driver
-        other_drivers = CustomerRequestDriverMapping.objects.filter(request=car_request).exclude(driver=car_request.driver)
+        other_drivers = CustomerRequestDriverMapping.objects.filter(request=car_request).exclude(driver=car_request.driver).select_related("driver")
 
         for mapping in other_drivers:
             async_to_sync(channel_layer.group_send)(
@@ -275,6 +230,7 @@ class CompleteCarRequestView(APIView):
 
         redis_client.delete(f"{car_request.driver.username}_has_customer")
         redis_client.delete(f"{car_request.customer.username}_has_driver")
+        set_driver_busy(car_request.driver.username, car_request.driver.type, False)
 
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
@@ -309,68 +265,109 @@ class CarRequestListView(APIView):
 
     def get(self, request):
         status_filter = request.query_params.get("status")
-        req_data = {}
-        
-        if request.user.user_type == "driver":
-            car_requests = CustomerRequest.objects.filter(driver=request.user).prefetch_related("driver")
+
+        # Answered from the user's current trip in Redis, see orders/trip_state.py
+        found, trip = read_current_trip(request.user.id)
+        if not found:
+            latest = current_request(request.user.id, request.user.user_type == "driver")
+            fill_current_trip(request.user.id, latest)
+            trip = self.live_trip(latest)
+
+        user_state = trip["status"] if trip else None
+
+        if status_filter and status_filter != user_state:
+            trip = self.live_trip(self.user_requests(request.user).filter(status=status_filter).first())
+
+        return Response(data_response(200, "Car requests retrieved successfully.", {"user_state":user_state,"requests": trip or {}}), status=status.HTTP_200_OK)
+
+    def user_requests(self, user):
+        return user_requests(user.id, user.user_type == "driver")
+
+    def live_trip(self, car_request):
+        """
+        trip_data of the request with the driver's location from Redis.
+        """
+        if car_request is None:
+            return None
+        trip = trip_data(car_request)
+        if car_request.driver:
+            position = driver_positions([car_request.driver.username]).get(car_request.driver.username)
+            trip = with_driver_location(trip, position)
+        return trip
+
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_PAGE_MAX = 100
+# "<timestamp in epoch microseconds>-<id>" of the last request of a page,
+# bounded so both parts fit a datetime and a bigint
+HISTORY_CURSOR = re.compile(r"^(\d{1,18})-(\d{1,18})$")
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class CarRequestHistoryView(APIView):
+    """
+    The user's past requests, newest first, `limit` per page.
+
+    Pages are keyset paginated on (timestamp, id): `next_cursor` is the
+    position of the last request of the page and the next page starts right
+    after it through the CustomerRequest history indexes, so every page
+    costs the same however long the user's history is.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        cursor = request.query_params.get("cursor")
+        try:
+            limit = min(max(int(request.query_params.get("limit", HISTORY_PAGE_SIZE)), 1), HISTORY_PAGE_MAX)
+        except ValueError:
+            return Response(data_response(400, "limit must be a number.", {}), status=status.HTTP_400_BAD_REQUEST)
+
+        car_requests = self.user_requests(request.user)
+        if cursor:
+            match = HISTORY_CURSOR.match(cursor)
+            try:
+                if not match:
+                    raise ValueError(cursor)
+                # Past year 9999 still overflows
+                timestamp = EPOCH + timedelta(microseconds=int(match.group(1)))
+            except (OverflowError, ValueError):
+                return Response(data_response(400, "Invalid cursor.", {}), status=status.HTTP_400_BAD_REQUEST)
+            request_id = int(match.group(2))
+            car_requests = car_requests.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=request_id)
+            )
+
+        # One extra row tells whether there is a next page
+        page = list(car_requests[:limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            last = page[-1]
+            next_cursor = f"{(last.timestamp - EPOCH) // timedelta(microseconds=1)}-{last.id}"
+
+        return Response(
+            data_response(200, "Car request history retrieved successfully.", {
+                "requests": CustomerRequestHistorySerializer(page, many=True).data,
+                "next_cursor": next_cursor,
+            }),
+            status=status.HTTP_200_OK
+        )
+
+    def user_requests(self, user):
+        if user.user_type == "driver":
+            car_requests = CustomerRequest.objects.filter(driver=user)
         else:
-            car_requests = CustomerRequest.objects.filter(customer=request.user).prefetch_related("driver")
-        
-        car_requests = car_requests.order_by("-timestamp")
-        
-        user_state = car_requests[0].status if car_requests else None
-        
-        if status_filter:
-            car_requests = car_requests.filter(status=status_filter)
-        
-        response_data = []
-        for request_data in car_requests:
-            # if request.user.user_type == "driver":
-            #     request_data.pop("otp", None)  
-            response_data.append(request_data)
+            car_requests = CustomerRequest.objects.filter(customer=user)
+        return (
+            car_requests.select_related("customer", "driver")
+            .only(
+                "id", "request_type", "status", "latitude", "longitude", "timestamp", "additional_details",
+                "customer__username", "customer__first_name", "customer__last_name",
+                "driver__username", "driver__first_name", "driver__last_name",
+            )
+            .order_by("-timestamp", "-id")
+        )
 
-        response_requests = {}
-        
-        if response_data:
-            req = response_data[0]
-            driver_data ={}
-            if req.driver:
-                driver_location = redis_client.geopos("drivers_locations", req.driver.username)
-
-                driver_lat, driver_lon = (None, None)
-                if driver_location and driver_location[0]:  # Ensure location exists
-                    driver_lon, driver_lat = driver_location[0]  
-                driver_data = {
-                        "username": req.driver.username,
-                        "name": req.driver.get_full_name(),
-                        "phone": str(req.driver.phone_number),
-                        "car_type": req.driver.get_type_display(),
-                        "profile_pic": req.driver.driver_pic.url if req.driver.driver_pic else None,
-                        "location": {
-                            "lat": float(driver_lat) if driver_lat else None,
-                            "lon": float(driver_lon) if driver_lon else None,
-                        }
-                    }
-            
-            req_data = {
-                "id": req.id,
-                "request_type": req.request_type,
-                "status": req.status,
-                "latitude": req.latitude,
-                "longitude": req.longitude,
-                "timestamp": req.timestamp,
-                "additional_details": req.additional_details,
-                "driver": driver_data,
-                "customer": {
-                    "username": req.customer.username,
-                    "name": req.customer.get_full_name(),
-                    "phone": str(req.customer.phone_number)
-                }
-            }
-            
-        
-        return Response(data_response(200, "Car requests retrieved successfully.", {"user_state":user_state,"requests": req_data}), status=status.HTTP_200_OK)
-    
 
 class CancelCarRequestView(APIView):
     permission_classes = [IsAuthenticated]
@@ -400,6 +397,7 @@ class CancelCarRequestView(APIView):
 
         # Notify assigned driver if exists
         if car_request.driver:
+            set_driver_busy(car_request.driver.username, car_request.driver.type, False)
             self.notify_driver(car_request)
 
         self.notify_other_drivers(car_request)
@@ -443,7 +441,7 @@ class CancelCarRequestView(APIView):
         channel_layer = get_channel_layer()
 
         # Get all drivers who received this request except the accepted driver
-        other_drivers = CustomerRequestDriverMapping.objects.filter(request=car_request).exclude(driver=car_request.driver)
+        other_drivers = CustomerRequestDriverMapping.objects.filter(request=car_request).exclude(driver=car_request.driver).select_related("driver")
 
         for mapping in other_drivers:
             async_to_sync(channel_layer.group_send)(
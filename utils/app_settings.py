@@ -0,0 +1,89 @@
+"""
+Process-wide cache of the admin-edited singleton settings rows.
+
+`get_application_settings()` and `get_website_settings()` read the first
+row once per process. Saving or deleting a row drops the local copy and
+publishes its model label on SETTINGS_CHANNEL; every other daphne or
+worker process listens on that channel and drops its copy as well. The
+cached copies also expire after CACHE_TTL seconds in case a message is
+lost while a listener is reconnecting.
+"""
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ApplicationSettings, WebsiteSettings
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+SETTINGS_CHANNEL = "settings_invalidation"
+CACHE_TTL = 300
+
+_cache = {}
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_application_settings():
+    return _get(ApplicationSettings)
+
+
+def get_website_settings():
+    return _get(WebsiteSettings)
+
+
+def _get(model):
+    _start_listener()
+    label = model._meta.label
+    cached = _cache.get(label)
+    if cached is None or cached[1] < time.monotonic():
+        # Cache the missing row as well, `None` is a valid answer
+        cached = (model.objects.first(), time.monotonic() + CACHE_TTL)
+        _cache[label] = cached
+    return cached[0]
+
+
+def invalidate(label=None):
+    if label is None:
+        _cache.clear()
+    else:
+        _cache.pop(label, None)
+
+
+def _start_listener():
+    global _listener
+    if _listener is not None:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name="settings-invalidation", daemon=True)
+            _listener.start()
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(SETTINGS_CHANNEL)
+            # Anything published while we were not subscribed is lost
+            invalidate()
+            for message in pubsub.listen():
+                invalidate(message["data"])
+        except redis.RedisError as e:
+            print("[ERROR] Settings invalidation listener:", str(e))
+            time.sleep(1)
+
+
+@receiver([post_save, post_delete], sender=ApplicationSettings)
+@receiver([post_save, post_delete], sender=WebsiteSettings)
+def settings_changed(sender, **kwargs):
+    label = sender._meta.label
+    invalidate(label)
+    try:
+        redis_client.publish(SETTINGS_CHANNEL, label)
+    except redis.RedisError as e:
+        print("[ERROR] Failed publishing settings invalidation:", str(e))
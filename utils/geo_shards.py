@@ -0,0 +1,182 @@
+"""
+Optional geohash sharding of the dispatch geo keys.
+
+With GEO_SHARD_PRECISION > 0 every dispatch key is split per geohash cell
+of that precision: `drivers_available` becomes `drivers_available:{cell}`
+and so on. A search only reads the cells its circle's bounding box
+touches, so its cost follows local density instead of fleet size. Each
+cell lives on one of GEO_SHARD_REDIS_URLS, picked by a hash of the cell.
+
+Pick a precision whose cells are not much smaller than the usual search
+radius (4 is about 39 x 20 km, 5 about 4.9 x 4.9 km). Otherwise a search
+has to read many cells.
+
+The driver's current cell is kept in the `cell` field of their
+driver_state hash, see utils.locations, so a driver crossing a cell
+boundary is moved out of the old one.
+"""
+import math
+import zlib
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+shard_clients = [redis.Redis.from_url(url, decode_responses=True) for url in settings.GEO_SHARD_REDIS_URLS]
+async_shard_clients = [
+    redis.asyncio.Redis.from_url(url, decode_responses=True, max_connections=settings.REDIS_ASYNC_MAX_CONNECTIONS)
+    for url in settings.GEO_SHARD_REDIS_URLS
+]
+
+
+def enabled():
+    return settings.GEO_SHARD_PRECISION > 0
+
+
+def grid(precision):
+    """
+    Longitude and latitude bits of a geohash, longitude takes the odd one.
+    """
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def encode_cell(x, y, precision):
+    """
+    Geohash of the cell at grid column `x` and row `y`.
+    """
+    lon_bits, lat_bits = grid(precision)
+    value = 0
+    for i in range(5 * precision):
+        # Bits interleave starting with longitude, most significant first
+        if i % 2 == 0:
+            bit = (x >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (y >> (lat_bits - 1 - i // 2)) & 1
+        value = (value << 1) | bit
+    return "".join(BASE32[(value >> 5 * (precision - 1 - i)) & 31] for i in range(precision))
+
+
+def cell_index(latitude, longitude, precision):
+    lon_bits, lat_bits = grid(precision)
+    x = int((float(longitude) + 180) / 360 * 2 ** lon_bits)
+    y = int((float(latitude) + 90) / 180 * 2 ** lat_bits)
+    return min(x, 2 ** lon_bits - 1), min(y, 2 ** lat_bits - 1)
+
+
+def cell_of(longitude, latitude):
+    """
+    Cell of a position at GEO_SHARD_PRECISION.
+    """
+    precision = settings.GEO_SHARD_PRECISION
+    return encode_cell(*cell_index(latitude, longitude, precision), precision)
+
+
+def cells_for_radius(longitude, latitude, radius_km):
+    """
+    Cells overlapping the bounding box of a search circle.
+    """
+    precision = settings.GEO_SHARD_PRECISION
+    lon_bits, _ = grid(precision)
+    lat_delta = radius_km / 111.32
+    cos_lat = math.cos(math.radians(float(latitude)))
+    lon_delta = 180 if cos_lat < 1e-6 else min(radius_km / (111.32 * cos_lat), 180)
+
+    _, y_min = cell_index(max(float(latitude) - lat_delta, -90), longitude, precision)
+    _, y_max = cell_index(min(float(latitude) + lat_delta, 90), longitude, precision)
+    # Longitude wraps around the antimeridian, latitude is clamped
+    columns = 2 ** lon_bits
+    if lon_delta >= 180:
+        xs = range(columns)
+    else:
+        x_min = math.floor((float(longitude) - lon_delta + 180) / 360 * columns)
+        x_max = math.floor((float(longitude) + lon_delta + 180) / 360 * columns)
+        xs = [x % columns for x in range(x_min, x_max + 1)]
+    return [encode_cell(x, y, precision) for x in xs for y in range(y_min, y_max + 1)]
+
+
+def shard_key(key, cell):
+    return f"{key}:{cell}"
+
+
+def shard_index(cell):
+    return zlib.crc32(cell.encode()) % len(shard_clients)
+
+
+def queue_cell_updates(pipes, updates):
+    """
+    Queues the writes of `updates` on the pipeline of each shard, which
+    `pipes(index)` returns.
+    """
+    for username, keys, previous_cell, cell, position in updates:
+        if previous_cell and previous_cell != cell:
+            pipe = pipes(shard_index(previous_cell))
+            for key in keys:
+                pipe.zrem(shard_key(key, previous_cell), username)
+        if cell:
+            longitude, latitude = position
+            pipe = pipes(shard_index(cell))
+            for key in keys:
+                pipe.geoadd(shard_key(key, cell), (longitude, latitude, username))
+
+
+def update_cells(updates):
+    """
+    Applies (username, dispatch keys, previous cell, new cell, position)
+    updates: the driver leaves `previous cell` and is added to `new cell`
+    at `position`, either cell may be None.
+    """
+    pipes = {}
+
+    def pipe(index):
+        if index not in pipes:
+            pipes[index] = shard_clients[index].pipeline(transaction=False)
+        return pipes[index]
+
+    queue_cell_updates(pipe, updates)
+    for shard_pipe in pipes.values():
+        shard_pipe.execute()
+
+
+async def aupdate_cells(updates):
+    pipes = {}
+
+    def pipe(index):
+        if index not in pipes:
+            pipes[index] = async_shard_clients[index].pipeline(transaction=False)
+        return pipes[index]
+
+    queue_cell_updates(pipe, updates)
+    for shard_pipe in pipes.values():
+        await shard_pipe.execute()
+
+
+def search(key, longitude, latitude, radius_km, count=None, withdist=False):
+    """
+    Members of the sharded `key` within `radius_km`, nearest first and at
+    most `count` when given. With `withdist` the items are (member,
+    distance in km).
+    """
+    by_shard = {}
+    for cell in cells_for_radius(longitude, latitude, radius_km):
+        by_shard.setdefault(shard_index(cell), []).append(cell)
+
+    found = []
+    for index, cells in by_shard.items():
+        pipe = shard_clients[index].pipeline(transaction=False)
+        for cell in cells:
+            pipe.geosearch(
+                shard_key(key, cell), longitude=longitude, latitude=latitude, radius=radius_km, unit="km",
+                withdist=True, sort="ASC" if count else None, count=count,
+            )
+        for members in pipe.execute():
+            found.extend(members)
+
+    if count:
+        found.sort(key=lambda member: member[1])
+        found = found[:count]
+    if withdist:
+        return [(username, distance) for username, distance in found]
+    return [username for username, _ in found]
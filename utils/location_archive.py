@@ -0,0 +1,144 @@
+"""
+On-disk archive of driver location history.
+
+The archive_location_history command drains history older than
+LOCATION_ARCHIVE_AFTER seconds out of the Redis streams into append-only
+segments under LOCATION_ARCHIVE_DIR, one per driver per UTC day:
+
+    {LOCATION_ARCHIVE_DIR}/{username}/{YYYY-MM-DD}.ts   int64 epoch ms
+    {LOCATION_ARCHIVE_DIR}/{username}/{YYYY-MM-DD}.lat  float32
+    {LOCATION_ARCHIVE_DIR}/{username}/{YYYY-MM-DD}.lon  float32
+
+Columns are raw little-endian arrays in timestamp order and are memory
+mapped on read. A crash between column appends leaves them with
+different lengths; readers only use the rows all three columns have.
+"""
+import os
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+from django.conf import settings
+
+COLUMNS = {"ts": np.dtype("<i8"), "lat": np.dtype("<f4"), "lon": np.dtype("<f4")}
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def driver_dir(username):
+    # Usernames may contain dots, keep them from walking out of the archive
+    if username in (".", "..") or os.path.basename(username) != username:
+        return None
+    return os.path.join(settings.LOCATION_ARCHIVE_DIR, username)
+
+
+def segment_path(username, day, column):
+    return os.path.join(driver_dir(username), f"{day.isoformat()}.{column}")
+
+
+def segment_days(username):
+    """
+    Days with an archive segment for the driver, oldest first.
+    """
+    directory = driver_dir(username)
+    if not directory or not os.path.isdir(directory):
+        return []
+    days = []
+    for name in os.listdir(directory):
+        stem, _, column = name.partition(".")
+        if column == "ts":
+            try:
+                days.append(date.fromisoformat(stem))
+            except ValueError:
+                continue
+    return sorted(days)
+
+
+def segment_rows(username, day):
+    sizes = []
+    for column, dtype in COLUMNS.items():
+        try:
+            sizes.append(os.path.getsize(segment_path(username, day, column)) // dtype.itemsize)
+        except FileNotFoundError:
+            return 0
+    return min(sizes)
+
+
+def read_segment(username, day):
+    """
+    (timestamps, latitudes, longitudes) of one segment as memory maps.
+    """
+    rows = segment_rows(username, day)
+    if not rows:
+        return tuple(np.empty(0, dtype) for dtype in COLUMNS.values())
+    return tuple(
+        np.memmap(segment_path(username, day, column), dtype=dtype, mode="r", shape=(rows,))
+        for column, dtype in COLUMNS.items()
+    )
+
+
+def append_archive(username, timestamps, latitudes, longitudes):
+    """
+    Appends history rows, oldest first, to the segments of their days.
+    """
+    timestamps = np.asarray(timestamps, dtype=COLUMNS["ts"])
+    latitudes = np.asarray(latitudes, dtype=COLUMNS["lat"])
+    longitudes = np.asarray(longitudes, dtype=COLUMNS["lon"])
+    os.makedirs(driver_dir(username), exist_ok=True)
+
+    days, starts = np.unique(timestamps // DAY_MS, return_index=True)
+    bounds = list(starts[1:]) + [len(timestamps)]
+    for day_number, start, end in zip(days, starts, bounds):
+        day = date(1970, 1, 1) + timedelta(days=int(day_number))
+        # Timestamps last, a torn append is then never visible to readers
+        for column, values in (("lat", latitudes), ("lon", longitudes), ("ts", timestamps)):
+            with open(segment_path(username, day, column), "ab") as segment:
+                values[start:end].tofile(segment)
+
+
+def last_archived_timestamp(username):
+    """
+    Timestamp of the newest archived row of the driver, None without any.
+    """
+    for day in reversed(segment_days(username)):
+        rows = segment_rows(username, day)
+        if rows:
+            return int(np.fromfile(
+                segment_path(username, day, "ts"), dtype=COLUMNS["ts"], count=1,
+                offset=(rows - 1) * COLUMNS["ts"].itemsize,
+            )[0])
+    return None
+
+
+def iter_archive(username, since=None, until=None, chunk_size=None):
+    """
+    Yields archived history in the inclusive epoch millisecond window as
+    lists of history entries, one list per segment or per `chunk_size`
+    rows of it.
+    """
+    since_day = None if since is None else utc_day(since)
+    until_day = None if until is None else utc_day(until)
+    for day in segment_days(username):
+        if (since_day and day < since_day) or (until_day and day > until_day):
+            continue
+        timestamps, latitudes, longitudes = read_segment(username, day)
+        start = 0 if since is None else int(np.searchsorted(timestamps, since, side="left"))
+        end = len(timestamps) if until is None else int(np.searchsorted(timestamps, until, side="right"))
+        step = chunk_size or max(end - start, 1)
+        for offset in range(start, end, step):
+            rows = slice(offset, min(offset + step, end))
+            yield [
+                {"latitude": latitude, "longitude": longitude, "timestamp": timestamp}
+                for timestamp, latitude, longitude in zip(
+                    timestamps[rows].tolist(),
+                    # Shortest decimal of each float32, without the noise of widening it
+                    latitudes[rows].astype(str).astype(np.float64).tolist(),
+                    longitudes[rows].astype(str).astype(np.float64).tolist(),
+                )
+            ]
+
+
+def read_archive(username, since=None, until=None):
+    return [entry for entries in iter_archive(username, since, until) for entry in entries]
+
+
+def utc_day(timestamp):
+    return datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).date()
@@ -0,0 +1,145 @@
+"""
+Write-behind buffer for driver location fixes.
+
+Consumers hand their fixes to the process-wide `location_writer` instead
+of writing to Redis themselves. It keeps the latest position per driver
+plus every fix since the last flush, with the time it was received, for
+the history, and a background task
+writes the whole buffer every LOCATION_FLUSH_INTERVAL milliseconds as one
+pipeline of INGEST_DRIVER_LOCATION calls. Fixes that fail to flush are
+retried until they are LOCATION_MAX_STALENESS milliseconds old. Whatever
+is still buffered when the process exits is lost.
+"""
+import asyncio
+import time
+
+import redis
+from django.conf import settings
+
+from . import geo_shards
+from .locations import (
+    INGEST_DRIVER_LOCATION, aingest_driver_location, async_redis_client, ingest_driver_location_params,
+    ingested_cell_update,
+)
+
+
+class PendingFix:
+    def __init__(self, car_type, longitude, latitude, history, queued_at, future):
+        self.car_type = car_type
+        self.longitude = longitude
+        self.latitude = latitude
+        self.history = history
+        self.queued_at = queued_at
+        self.future = future
+
+    def resolve(self, result=None, error=None):
+        # The waiting consumer may have gone away in the meantime
+        if self.future.done():
+            return
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(result)
+
+
+class LocationWriter:
+    def __init__(self, flush_interval=None, max_staleness=None):
+        self.flush_interval = (settings.LOCATION_FLUSH_INTERVAL if flush_interval is None else flush_interval) / 1000
+        self.max_staleness = (settings.LOCATION_MAX_STALENESS if max_staleness is None else max_staleness) / 1000
+        self.pending = {}
+        self.task = None
+
+        self.flushes = 0
+        self.written = 0
+        self.coalesced = 0
+        self.expired = 0
+
+    async def write(self, username, car_type, longitude, latitude):
+        """
+        Stores a driver fix and returns (linked customer, admin) once it is
+        written, like aingest_driver_location. Returns None when a newer
+        fix of the same driver replaced this one before the flush.
+        """
+        fix = (int(time.time() * 1000), latitude, longitude)
+        if not self.flush_interval:
+            return await aingest_driver_location(username, car_type, longitude, latitude, [fix])
+
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+
+        future = loop.create_future()
+        previous = self.pending.get(username)
+        if previous:
+            previous.resolve()
+            self.coalesced += 1
+            self.pending[username] = PendingFix(
+                car_type, longitude, latitude, previous.history + [fix], previous.queued_at, future
+            )
+        else:
+            self.pending[username] = PendingFix(
+                car_type, longitude, latitude, [fix], time.monotonic(), future
+            )
+        return await future
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[ERROR] Location flush failed: {e}")
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+
+        pipe = async_redis_client.pipeline(transaction=False)
+        for username, fix in batch.items():
+            keys, args = ingest_driver_location_params(username, fix.car_type, fix.longitude, fix.latitude, fix.history)
+            await INGEST_DRIVER_LOCATION(keys=keys, args=args, client=pipe)
+        try:
+            replies = await pipe.execute(raise_on_error=False)
+        except redis.RedisError as e:
+            self.requeue(batch, e)
+            raise
+
+        self.flushes += 1
+        updates = [
+            ingested_cell_update(username, fix.car_type, fix.longitude, fix.latitude, reply)
+            for (username, fix), reply in zip(batch.items(), replies) if not isinstance(reply, Exception)
+        ]
+        try:
+            if any(updates):
+                await geo_shards.aupdate_cells([update for update in updates if update])
+        finally:
+            for fix, reply in zip(batch.values(), replies):
+                if isinstance(reply, Exception):
+                    fix.resolve(error=reply)
+                else:
+                    self.written += 1
+                    fix.resolve(tuple(reply[:2]))
+
+    def requeue(self, batch, error):
+        """
+        Puts a failed batch back in front of the fixes that came in while
+        it was being written, dropping the ones past max staleness.
+        """
+        now = time.monotonic()
+        for username, fix in batch.items():
+            if now - fix.queued_at >= self.max_staleness:
+                self.expired += 1
+                fix.resolve(error=error)
+                continue
+            newer = self.pending.get(username)
+            if newer:
+                newer.history[:0] = fix.history
+                newer.queued_at = fix.queued_at
+                fix.resolve()
+                self.coalesced += 1
+            else:
+                self.pending[username] = fix
+
+
+location_writer = LocationWriter()
@@ -0,0 +1,643 @@
+"""
+Redis geo keys for user positions.
+
+`drivers_locations` holds the last position of every driver and is what
+the dashboard and customers read. Dispatch reads `drivers_available` and
+`drivers_available:{User.type}` instead, which only contain drivers that
+can take a request, so a search never returns drivers that have to be
+filtered out again in the database.
+
+Each driver's path is kept in the `location_history:{username}` stream.
+Entry IDs are the epoch milliseconds the server received the fix at plus
+a sequence number, entries hold `lat`/`lon`, and
+the stream is capped at LOCATION_HISTORY_MAXLEN entries and
+LOCATION_HISTORY_RETENTION seconds. Older history is moved to the
+on-disk archive, see location_archive; the history readers here return
+both.
+
+`drivers_last_seen` scores every driver with the epoch milliseconds of
+their last location update. Dispatch ignores drivers whose fix is older
+than ApplicationSettings.location_max_age, and the dispatch workers evict
+them from the dispatch keys until their next update.
+
+Availability is tracked in the `driver_state:{username}` hash (on_duty,
+open WebSocket connections, busy with a customer). Every event that
+changes it re-evaluates the driver's membership in the dispatch keys.
+With GEO_SHARD_PRECISION set the dispatch keys are split per geohash
+cell, see geo_shards, and the hash also keeps the driver's `cell`. With
+the memory search backend every change is also appended to the stream
+the in-process index follows, see spatial_index.
+
+The `a`-prefixed variants do the same through `async_redis_client` and
+are what the WebSocket consumer uses, so a Redis round-trip never blocks
+the event loop.
+"""
+import math
+import time
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+from . import geo_shards, spatial_index
+from .location_archive import iter_archive, last_archived_timestamp
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+# One pool per process shared by every consumer; callers wait for a free
+# connection instead of opening one per socket
+async_pool = redis.asyncio.BlockingConnectionPool.from_url(
+    settings.REDIS_URL, decode_responses=True, max_connections=settings.REDIS_ASYNC_MAX_CONNECTIONS
+)
+async_redis_client = redis.asyncio.Redis(connection_pool=async_pool)
+
+DRIVERS_LOCATIONS = "drivers_locations"
+CUSTOMERS_LOCATIONS = "customers_locations"
+AVAILABLE_DRIVERS = "drivers_available"
+DRIVERS_LAST_SEEN = "drivers_last_seen"
+
+
+def distance_m(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great-circle distance in meters between two points.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (latitude1, longitude1, latitude2, longitude2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+def available_drivers_key(car_type=None):
+    """
+    Geo key of available drivers, limited to one User.type when given.
+    """
+    return f"{AVAILABLE_DRIVERS}:{car_type}" if car_type else AVAILABLE_DRIVERS
+
+
+def dispatch_keys(car_type=None):
+    """
+    Every dispatch key a driver of `car_type` is a member of.
+    """
+    return [AVAILABLE_DRIVERS] + ([available_drivers_key(car_type)] if car_type else [])
+
+
+def search_available_drivers(car_type, longitude, latitude, radius_km, count=None, max_age=0, withdist=False):
+    """
+    Usernames of available drivers within `radius_km`, limited to one
+    User.type when given, nearest first and at most `count` when given.
+    `max_age` drops drivers whose last fix is older, in seconds. With
+    `withdist` the items are (username, distance in km).
+    """
+    if spatial_index.enabled():
+        spatial_index.driver_index.start()
+        return spatial_index.driver_index.search(longitude, latitude, radius_km, car_type, count, max_age, withdist)
+
+    key = available_drivers_key(car_type)
+    if not max_age:
+        return search_dispatch_key(key, longitude, latitude, radius_km, count, withdist)
+
+    # Stale drivers are only dropped after the search, so a limited search
+    # asks for more until `count` fresh ones are found or the radius is
+    # exhausted, as the memory index filters before it limits
+    fetch = count * 2 if count else None
+    while True:
+        candidates = search_dispatch_key(key, longitude, latitude, radius_km, fetch, withdist=True)
+        fresh = set(fresh_drivers([username for username, _ in candidates], max_age))
+        found = [(username, distance) for username, distance in candidates if username in fresh]
+        if not count or len(found) >= count or len(candidates) < fetch:
+            break
+        fetch *= 2
+    found = found[:count] if count else found
+    return found if withdist else [username for username, _ in found]
+
+
+def search_dispatch_key(key, longitude, latitude, radius_km, count=None, withdist=False):
+    """
+    GEOSEARCH of a dispatch key, through the shards when sharded.
+    """
+    if geo_shards.enabled():
+        return geo_shards.search(key, longitude, latitude, radius_km, count, withdist)
+    return redis_client.geosearch(
+        key, longitude=longitude, latitude=latitude, radius=radius_km, unit="km",
+        sort="ASC" if count else None, count=count, withdist=withdist,
+    )
+
+
+def location_history_key(username):
+    return f"location_history:{username}"
+
+
+def driver_state_key(username):
+    return f"driver_state:{username}"
+
+
+def is_driver_available(on_duty, connections, busy):
+    """
+    A driver can be dispatched when on duty, connected over at least one
+    WebSocket and not already serving a customer.
+    """
+    return on_duty == "1" and int(connections or 0) > 0 and busy != "1"
+
+
+def update_driver_location(username, car_type, longitude, latitude):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.geoadd(DRIVERS_LOCATIONS, (longitude, latitude, username))
+    pipe.zadd(DRIVERS_LAST_SEEN, {username: int(time.time() * 1000)})
+    pipe.hmget(driver_state_key(username), "on_duty", "connections", "busy")
+    _, _, state = pipe.execute()
+    set_driver_available(username, car_type, is_driver_available(*state), (longitude, latitude))
+
+
+# Same as update_driver_location plus the history append and the lookups
+# the consumer needs afterwards, in one round-trip. Availability mirrors
+# is_driver_available. With sharding no dispatch keys are passed, the
+# cell is recorded instead and the caller moves the driver between cells
+# with the returned availability and previous cell. The dispatch_updates
+# entry is only written with the memory search backend.
+# KEYS: drivers_locations, driver_state, location_history,
+#       {username}_has_customer, driver_admin:{username}, drivers_last_seen,
+#       dispatch_updates, then the dispatch keys
+# ARGV: username, longitude, latitude, history maxlen, history min id,
+#       history ttl in ms, now in epoch ms, cell or '' without sharding,
+#       dispatch_updates maxlen or 0, car type, then received at (epoch
+#       ms)/latitude/longitude triples for the history
+INGEST_DRIVER_LOCATION = async_redis_client.register_script("""
+redis.call('GEOADD', KEYS[1], ARGV[2], ARGV[3], ARGV[1])
+redis.call('ZADD', KEYS[6], ARGV[7], ARGV[1])
+local state = redis.call('HMGET', KEYS[2], 'on_duty', 'connections', 'busy')
+local available = state[1] == '1' and tonumber(state[2] or 0) > 0 and state[3] ~= '1'
+for i = 8, #KEYS do
+    if available then
+        redis.call('GEOADD', KEYS[i], ARGV[2], ARGV[3], ARGV[1])
+    else
+        redis.call('ZREM', KEYS[i], ARGV[1])
+    end
+end
+local previous_cell = false
+if ARGV[8] ~= '' then
+    previous_cell = redis.call('HGET', KEYS[2], 'cell')
+    if available then
+        redis.call('HSET', KEYS[2], 'cell', ARGV[8])
+    else
+        redis.call('HDEL', KEYS[2], 'cell')
+    end
+end
+if ARGV[9] ~= '0' then
+    if available then
+        redis.call('XADD', KEYS[7], 'MAXLEN', '~', ARGV[9], '*', 'u', ARGV[1], 't', ARGV[10], 'lon', ARGV[2], 'lat', ARGV[3])
+    else
+        redis.call('XADD', KEYS[7], 'MAXLEN', '~', ARGV[9], '*', 'u', ARGV[1], 't', ARGV[10])
+    end
+end
+-- Entry IDs are the receive times; one that is not after the last entry,
+-- e.g. from another process writing the same driver, goes right after it
+local last_ms, last_seq = -1, 0
+local last = redis.call('XREVRANGE', KEYS[3], '+', '-', 'COUNT', 1)[1]
+if last then
+    local ms, seq = string.match(last[1], '(%d+)-(%d+)')
+    last_ms, last_seq = tonumber(ms), tonumber(seq)
+end
+for i = 11, #ARGV, 3 do
+    local ms = tonumber(ARGV[i])
+    if ms > last_ms then
+        last_ms, last_seq = ms, 0
+    else
+        last_seq = last_seq + 1
+    end
+    local id = string.format('%.0f-%.0f', last_ms, last_seq)
+    redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[4], id, 'lat', ARGV[i + 1], 'lon', ARGV[i + 2])
+end
+redis.call('XTRIM', KEYS[3], 'MINID', '~', ARGV[5])
+redis.call('PEXPIRE', KEYS[3], ARGV[6])
+return {redis.call('GET', KEYS[4]), redis.call('GET', KEYS[5]), available and 1 or 0, previous_cell}
+""")
+
+
+def ingest_driver_location_params(username, car_type, longitude, latitude, history):
+    """
+    KEYS and ARGV for INGEST_DRIVER_LOCATION. `history` is a list of
+    (received at in epoch ms, latitude, longitude) to append.
+    """
+    keys = [
+        DRIVERS_LOCATIONS,
+        driver_state_key(username),
+        location_history_key(username),
+        f"{username}_has_customer",
+        f"driver_admin:{username}",
+        DRIVERS_LAST_SEEN,
+        spatial_index.DISPATCH_UPDATES,
+    ]
+    sharded = geo_shards.enabled()
+    if not sharded:
+        keys.extend(dispatch_keys(car_type))
+    now = int(time.time() * 1000)
+    retention_ms = int(settings.LOCATION_HISTORY_RETENTION * 1000)
+    args = [
+        username, longitude, latitude,
+        settings.LOCATION_HISTORY_MAXLEN, now - retention_ms, retention_ms, now,
+        geo_shards.cell_of(longitude, latitude) if sharded else "",
+        settings.DISPATCH_UPDATES_MAXLEN if spatial_index.enabled() else 0,
+        car_type or "",
+    ]
+    for fix in history:
+        args.extend(fix)
+    return keys, args
+
+
+async def aingest_driver_location(username, car_type, longitude, latitude, history):
+    """
+    Stores a driver fix and appends the `history` (received at in epoch ms,
+    latitude, longitude) triples to their location history. Returns the usernames of the linked
+    customer and the driver's admin, either may be None.
+    """
+    keys, args = ingest_driver_location_params(username, car_type, longitude, latitude, history)
+    reply = await INGEST_DRIVER_LOCATION(keys=keys, args=args, client=async_redis_client)
+    update = ingested_cell_update(username, car_type, longitude, latitude, reply)
+    if update:
+        await geo_shards.aupdate_cells([update])
+    customer_username, admin_username = reply[:2]
+    return customer_username, admin_username
+
+
+def ingested_cell_update(username, car_type, longitude, latitude, reply):
+    """
+    geo_shards.update_cells entry for an INGEST_DRIVER_LOCATION reply, None
+    without sharding.
+    """
+    if not geo_shards.enabled():
+        return None
+    _, _, available, previous_cell = reply
+    cell = geo_shards.cell_of(longitude, latitude) if available else None
+    return username, dispatch_keys(car_type), previous_cell, cell, (longitude, latitude)
+
+
+def set_driver_available(username, car_type, available, position=None):
+    """
+    Adds the driver to or removes them from the dispatch geo keys.
+    `position` is (longitude, latitude); a driver without one stays out
+    until their next location update.
+    """
+    if geo_shards.enabled():
+        set_driver_cell(username, car_type, available, position)
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    queue_driver_available(pipe, username, car_type, available, position)
+    pipe.execute()
+
+
+async def aset_driver_available(username, car_type, available, position=None):
+    if geo_shards.enabled():
+        await aset_driver_cell(username, car_type, available, position)
+        return
+    pipe = async_redis_client.pipeline(transaction=False)
+    queue_driver_available(pipe, username, car_type, available, position)
+    await pipe.execute()
+
+
+def queue_driver_available(pipe, username, car_type, available, position):
+    """
+    Queues the dispatch key updates on a sync or asyncio pipeline.
+    """
+    if available and position:
+        longitude, latitude = position
+        for key in dispatch_keys(car_type):
+            pipe.geoadd(key, (longitude, latitude, username))
+    elif not available:
+        for key in dispatch_keys(car_type):
+            pipe.zrem(key, username)
+    queue_dispatch_update(pipe, username, car_type, available, position)
+
+
+def queue_dispatch_update(pipe, username, car_type, available, position):
+    """
+    Queues the dispatch_updates entry of a change for the in-process index,
+    nothing without the memory search backend.
+    """
+    if not spatial_index.enabled() or (available and not position):
+        return
+    fields = {"u": username, "t": car_type or ""}
+    if available:
+        fields["lon"], fields["lat"] = position
+    pipe.xadd(spatial_index.DISPATCH_UPDATES, fields, maxlen=settings.DISPATCH_UPDATES_MAXLEN, approximate=True)
+
+
+def set_driver_cell(username, car_type, available, position=None):
+    """
+    set_driver_available with sharded dispatch keys: records the driver's
+    new cell and moves them out of the previous one.
+    """
+    if available and not position:
+        return
+    cell = geo_shards.cell_of(*position) if available else None
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hget(driver_state_key(username), "cell")
+    queue_driver_cell(pipe, username, cell)
+    queue_dispatch_update(pipe, username, car_type, available, position)
+    previous_cell = pipe.execute()[0]
+    geo_shards.update_cells([(username, dispatch_keys(car_type), previous_cell, cell, position)])
+
+
+async def aset_driver_cell(username, car_type, available, position=None):
+    if available and not position:
+        return
+    cell = geo_shards.cell_of(*position) if available else None
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.hget(driver_state_key(username), "cell")
+    queue_driver_cell(pipe, username, cell)
+    queue_dispatch_update(pipe, username, car_type, available, position)
+    previous_cell = (await pipe.execute())[0]
+    await geo_shards.aupdate_cells([(username, dispatch_keys(car_type), previous_cell, cell, position)])
+
+
+def queue_driver_cell(pipe, username, cell):
+    if cell:
+        pipe.hset(driver_state_key(username), "cell", cell)
+    else:
+        pipe.hdel(driver_state_key(username), "cell")
+
+
+def refresh_driver_availability(username, car_type):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hmget(driver_state_key(username), "on_duty", "connections", "busy")
+    pipe.geopos(DRIVERS_LOCATIONS, username)
+    state, positions = pipe.execute()
+    set_driver_available(username, car_type, is_driver_available(*state), positions[0])
+
+
+async def arefresh_driver_availability(username, car_type):
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.hmget(driver_state_key(username), "on_duty", "connections", "busy")
+    pipe.geopos(DRIVERS_LOCATIONS, username)
+    state, positions = await pipe.execute()
+    await aset_driver_available(username, car_type, is_driver_available(*state), positions[0])
+
+
+def set_driver_on_duty(username, car_type, on_duty):
+    redis_client.hset(driver_state_key(username), "on_duty", int(on_duty))
+    refresh_driver_availability(username, car_type)
+
+
+def set_driver_busy(username, car_type, busy):
+    redis_client.hset(driver_state_key(username), "busy", int(busy))
+    refresh_driver_availability(username, car_type)
+
+
+def driver_connected(username, car_type, on_duty):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hincrby(driver_state_key(username), "connections", 1)
+    pipe.hset(driver_state_key(username), "on_duty", int(on_duty))
+    pipe.execute()
+    refresh_driver_availability(username, car_type)
+
+
+async def adriver_connected(username, car_type, on_duty):
+    pipe = async_redis_client.pipeline(transaction=False)
+    pipe.hincrby(driver_state_key(username), "connections", 1)
+    pipe.hset(driver_state_key(username), "on_duty", int(on_duty))
+    await pipe.execute()
+    await arefresh_driver_availability(username, car_type)
+
+
+async def adriver_disconnected(username, car_type):
+    # Counted per socket, a driver with the app open twice stays connected
+    if await async_redis_client.hincrby(driver_state_key(username), "connections", -1) < 0:
+        await async_redis_client.hset(driver_state_key(username), "connections", 0)
+    await arefresh_driver_availability(username, car_type)
+
+
+def driver_positions(usernames, chunk_size=1000):
+    """
+    (longitude, latitude) of each driver by username, drivers without a
+    position are left out. One GEOPOS per `chunk_size` drivers, all sent
+    in one pipeline.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for start in range(0, len(usernames), chunk_size):
+        pipe.geopos(DRIVERS_LOCATIONS, *usernames[start:start + chunk_size])
+    positions = [position for chunk in pipe.execute() for position in chunk]
+    return {username: tuple(position) for username, position in zip(usernames, positions) if position}
+
+
+def last_seen(usernames):
+    """
+    Epoch milliseconds of each driver's last location update, None for
+    drivers without one.
+    """
+    if not usernames:
+        return []
+    return redis_client.zmscore(DRIVERS_LAST_SEEN, usernames)
+
+
+def fresh_drivers(usernames, max_age):
+    """
+    The `usernames` whose last location update is at most `max_age`
+    seconds old, in the same order.
+    """
+    cutoff = (time.time() - max_age) * 1000
+    return [username for username, seen in zip(usernames, last_seen(usernames)) if seen is not None and seen >= cutoff]
+
+
+def evict_stale_drivers(max_age, car_types=(), batch=1000):
+    """
+    Removes drivers without a location update in the last `max_age` seconds
+    from the dispatch keys; their next update adds them back. Returns how
+    many were evicted.
+    """
+    cutoff = int((time.time() - max_age) * 1000)
+    keys = dispatch_keys() + [available_drivers_key(car_type) for car_type in car_types]
+    evicted = 0
+    # Paged by score, drivers that report during the sweep leave the range
+    # and would shift offsets. Only members tied on the last score are
+    # skipped by offset.
+    low, ties = "-inf", 0
+    while True:
+        rows = redis_client.zrangebyscore(
+            DRIVERS_LAST_SEEN, low, f"({cutoff}", start=ties, num=batch, withscores=True
+        )
+        if not rows:
+            break
+        stale = [username for username, _ in rows]
+        last_score = rows[-1][1]
+        tied = sum(1 for _, score in rows if score == last_score)
+        ties = ties + tied if low == last_score else tied
+        low = last_score
+        pipe = redis_client.pipeline(transaction=False)
+        for username in stale:
+            queue_dispatch_update(pipe, username, None, False, None)
+        if geo_shards.enabled():
+            for username in stale:
+                pipe.hget(driver_state_key(username), "cell")
+                queue_driver_cell(pipe, username, None)
+            cells = pipe.execute()[-2 * len(stale)::2]
+            geo_shards.update_cells([(username, keys, cell, None, None) for username, cell in zip(stale, cells)])
+        else:
+            for key in keys:
+                pipe.zrem(key, *stale)
+            pipe.execute()
+        evicted += len(stale)
+    # By score, so a driver that reported in the meantime stays
+    redis_client.zremrangebyscore(DRIVERS_LAST_SEEN, "-inf", f"({cutoff}")
+    return evicted
+
+
+def remove_driver_location(username, car_type):
+    if geo_shards.enabled():
+        set_driver_cell(username, car_type, False)
+    pipe = redis_client.pipeline(transaction=False)
+    queue_remove_driver(pipe, username, car_type)
+    pipe.execute()
+
+
+async def aremove_driver_location(username, car_type):
+    if geo_shards.enabled():
+        await aset_driver_cell(username, car_type, False)
+    pipe = async_redis_client.pipeline(transaction=False)
+    queue_remove_driver(pipe, username, car_type)
+    await pipe.execute()
+
+
+def queue_remove_driver(pipe, username, car_type):
+    pipe.zrem(DRIVERS_LOCATIONS, username)
+    pipe.zrem(DRIVERS_LAST_SEEN, username)
+    for key in dispatch_keys(car_type):
+        pipe.zrem(key, username)
+    queue_dispatch_update(pipe, username, car_type, False, None)
+    pipe.delete(driver_state_key(username))
+
+
+def history_entry(entry_id, fields):
+    return {
+        "latitude": float(fields["lat"]),
+        "longitude": float(fields["lon"]),
+        "timestamp": int(entry_id.split("-")[0]),
+    }
+
+
+def live_history_since(archived, since):
+    """
+    Start of the part of a window that is read from Redis, given the
+    newest archived timestamp: right after it, anything up to it is read
+    from the archive.
+    """
+    if archived is None:
+        return since
+    return archived + 1 if since is None else max(since, archived + 1)
+
+
+def read_location_history(username, since=None, until=None):
+    """
+    Location history of a driver, oldest first, as dicts with latitude,
+    longitude and timestamp (epoch milliseconds). `since` and `until` are
+    inclusive epoch milliseconds.
+    """
+    return [entry for entries in iter_location_history(username, since, until) for entry in entries]
+
+
+def history_reads(username, since, until, archived, last_id):
+    """
+    Next step of a history read that has yielded the archive up to
+    `archived` and the stream up to `last_id` (None for nothing yet).
+    Returns the archive window still to yield, None when there is none,
+    the stream position to read from next and the archive boundary seen.
+
+    An archive run moves entries out of Redis between two reads, so the
+    boundary is read once per step and the caller checks it did not move
+    before yielding what it read from Redis.
+    """
+    boundary = last_archived_timestamp(username)
+    window = None
+    if boundary is not None and (archived is None or boundary > archived):
+        low = since if archived is None else live_history_since(archived, since)
+        if last_id:
+            low = max(low or 0, int(last_id.split("-")[0]) + 1)
+        window = (low, boundary if until is None else min(until, boundary))
+        archived = boundary
+    if last_id and (archived is None or int(last_id.split("-")[0]) > archived):
+        start = f"({last_id}"
+    else:
+        start = live_history_since(archived, since)
+        start = "-" if start is None else start
+    return window, start, archived, boundary
+
+
+def iter_location_history(username, since=None, until=None, chunk_size=1000):
+    """
+    Sync aiter_location_history, yields the window from the archive and
+    then from Redis in lists of up to `chunk_size` entries.
+    """
+    archived = last_id = None
+    while True:
+        window, start, archived, boundary = history_reads(username, since, until, archived, last_id)
+        if window:
+            yield from iter_archive(username, *window, chunk_size)
+        entries = redis_client.xrange(
+            location_history_key(username), min=start, max="+" if until is None else until, count=chunk_size
+        )
+        if last_archived_timestamp(username) != boundary:
+            # Archived while we read, the entries may have left Redis
+            continue
+        if entries:
+            yield [history_entry(entry_id, fields) for entry_id, fields in entries]
+            last_id = entries[-1][0]
+        if len(entries) < chunk_size:
+            return
+
+
+def read_location_history_page(username, since=None, until=None, cursor=None, limit=1000):
+    """
+    One page of the history window, archived and live entries alike.
+    `cursor` is the one returned with the previous page. Returns the
+    entries and the cursor of the next page, None once the window is
+    exhausted.
+
+    A cursor is `{timestamp}-{count}`: the timestamp of the last entry
+    returned and how many entries with that timestamp were returned so
+    far. Archived entries only keep the millisecond, so it does not rely
+    on stream IDs and carries over from the archive to Redis, and across
+    an archive run between two pages.
+    """
+    skip = 0
+    if cursor:
+        after, skip = (int(part) for part in cursor.split("-"))
+        since = after if since is None else max(since, after)
+
+    page = []
+    # One entry more than the page tells whether there is a next one
+    for entries in iter_location_history(username, since, until, limit + skip + 1):
+        page.extend(entries)
+        if len(page) > limit + skip:
+            break
+    # Entries at the cursor's timestamp come first, drop the ones already sent
+    page = page[skip:]
+    if len(page) <= limit:
+        return page, None
+
+    page = page[:limit]
+    last = page[-1]["timestamp"]
+    count = sum(1 for entry in page if entry["timestamp"] == last)
+    if cursor and last == after:
+        count += skip
+    return page, f"{last}-{count}"
+
+
+async def aiter_location_history(username, since=None, until=None, chunk_size=1000):
+    """
+    Yields the history window in lists of up to `chunk_size` entries,
+    reading one slice from the archive or Redis per list.
+    """
+    archived = last_id = None
+    while True:
+        window, start, archived, boundary = history_reads(username, since, until, archived, last_id)
+        if window:
+            for entries in iter_archive(username, *window, chunk_size):
+                yield entries
+        entries = await async_redis_client.xrange(
+            location_history_key(username), min=start, max="+" if until is None else until, count=chunk_size
+        )
+        if last_archived_timestamp(username) != boundary:
+            # Archived while we read, the entries may have left Redis
+            continue
+        if entries:
+            yield [history_entry(entry_id, fields) for entry_id, fields in entries]
+            last_id = entries[-1][0]
+        if len(entries) < chunk_size:
+            return
@@ -0,0 +1,79 @@
+import time
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from utils.location_archive import append_archive, last_archived_timestamp
+from utils.locations import location_history_key
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+HISTORY_PREFIX = location_history_key("")
+
+
+def entry_timestamp(entry_id):
+    return int(entry_id.split("-")[0])
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves driver location history older than LOCATION_ARCHIVE_AFTER seconds from the Redis streams "
+        "into the segment files under LOCATION_ARCHIVE_DIR. Run a single instance."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=60, help="Seconds between archive passes.")
+        parser.add_argument("--chunk", type=int, default=10000, help="Entries read from Redis per round-trip.")
+        parser.add_argument("--once", action="store_true", help="Run one pass and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            cutoff = int((time.time() - settings.LOCATION_ARCHIVE_AFTER) * 1000)
+            drivers = archived = 0
+            for key in redis_client.scan_iter(match=f"{HISTORY_PREFIX}*", count=1000):
+                try:
+                    count = self.archive_driver(key[len(HISTORY_PREFIX):], cutoff, options["chunk"])
+                except Exception as e:
+                    self.stderr.write(f"Archiving {key} failed: {e}")
+                    continue
+                drivers += bool(count)
+                archived += count
+            self.stdout.write(f"Archived {archived} entries of {drivers} drivers")
+
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
+
+    def archive_driver(self, username, cutoff, chunk):
+        """
+        Appends the driver's entries older than `cutoff` to the archive, then
+        trims them from the stream. The archive's newest timestamp is the
+        resume point, so a pass that died halfway is picked up again.
+        """
+        key = location_history_key(username)
+        last = last_archived_timestamp(username)
+        start = 0 if last is None else last + 1
+        archived = 0
+
+        while True:
+            entries = redis_client.xrange(key, min=start, max=cutoff - 1, count=chunk)
+            if not entries:
+                break
+            # Resuming goes by millisecond, so never split one between passes
+            if len(entries) == chunk:
+                tail = entry_timestamp(entries[-1][0])
+                entries = [entry for entry in entries if entry_timestamp(entry[0]) < tail] or entries
+
+            append_archive(
+                username,
+                [entry_timestamp(entry_id) for entry_id, _ in entries],
+                [float(fields["lat"]) for _, fields in entries],
+                [float(fields["lon"]) for _, fields in entries],
+            )
+            archived += len(entries)
+            start = entry_timestamp(entries[-1][0]) + 1
+
+        if start:
+            redis_client.xtrim(key, minid=start, approximate=False)
+        return archived
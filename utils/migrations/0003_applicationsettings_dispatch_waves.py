@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0002_emailaccount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsettings',
+            name='dispatch_mode',
+            field=models.CharField(choices=[('all', 'All drivers in radius'), ('nearest', 'Nearest drivers first, in waves')], default='all', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='applicationsettings',
+            name='dispatch_waves',
+            field=models.IntegerField(default=3),
+        ),
+        migrations.AddField(
+            model_name='applicationsettings',
+            name='drivers_per_wave',
+            field=models.IntegerField(default=5),
+        ),
+        migrations.AddField(
+            model_name='applicationsettings',
+            name='wave_timeout',
+            field=models.IntegerField(default=20, help_text='Seconds to wait for an accept before the next wave'),
+        ),
+    ]
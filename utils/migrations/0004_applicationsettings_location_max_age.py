@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0003_applicationsettings_dispatch_waves'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsettings',
+            name='location_max_age',
+            field=models.IntegerField(default=120, help_text="Seconds since a driver's last location update before dispatch skips them, 0 to never skip"),
+        ),
+    ]
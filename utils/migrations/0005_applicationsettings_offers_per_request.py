@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0004_applicationsettings_location_max_age'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='applicationsettings',
+            name='offers_per_request',
+            field=models.IntegerField(default=0, help_text="Drivers a request is offered to in 'all' mode, the best scored by distance, freshness, vehicle type and acceptance rate; 0 for every driver in radius"),
+        ),
+    ]
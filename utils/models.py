@@ -13,6 +13,12 @@ class ApplicationSettings(models.Model):
     maximum_requests_per_user = models.IntegerField(default=1)
     search_radius = models.IntegerField(default=10)
     send_request_to = models.CharField(max_length=50, choices=(('all', 'All Drivers'), ('type', 'Only to requested Type')), default='all')
+    dispatch_mode = models.CharField(max_length=50, choices=(('all', 'All drivers in radius'), ('nearest', 'Nearest drivers first, in waves')), default='all')
+    drivers_per_wave = models.IntegerField(default=5)
+    dispatch_waves = models.IntegerField(default=3)
+    wave_timeout = models.IntegerField(default=20, help_text="Seconds to wait for an accept before the next wave")
+    location_max_age = models.IntegerField(default=120, help_text="Seconds since a driver's last location update before dispatch skips them, 0 to never skip")
+    offers_per_request = models.IntegerField(default=0, help_text="Drivers a request is offered to in 'all' mode, the best scored by distance, freshness, vehicle type and acceptance rate; 0 for every driver in radius")
 
     def __str__(self):
         return f"Application Settings: maximum_requests_per_user={self.maximum_requests_per_user}, search_radius={self.search_radius}, send_request_to={self.send_request_to}"
@@ -0,0 +1,111 @@
+"""
+Douglas-Peucker simplification of driver paths for the dashboard map.
+
+Points are projected to meters around the path's mean latitude, so the
+tolerance is a distance in meters. `zoom_tolerance` turns a web map zoom
+level into the size of one screen pixel on the ground, the most a path
+can be simplified without visibly changing.
+"""
+import json
+import math
+
+import numpy as np
+import redis
+from django.conf import settings
+
+from .locations import location_history_key, read_location_history
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+EARTH_RADIUS_M = 6371000
+# Web Mercator meters per pixel at zoom 0 on the equator (256px tiles)
+ZOOM_0_METERS_PER_PIXEL = 156543.03392
+
+
+def zoom_tolerance(zoom, latitude):
+    return ZOOM_0_METERS_PER_PIXEL * math.cos(math.radians(latitude)) / 2 ** zoom
+
+
+def simplify(latitudes, longitudes, tolerance):
+    """
+    Indices of the points kept when simplifying the path to `tolerance`
+    meters, always including the first and last point.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    count = len(latitudes)
+    if count < 3:
+        return np.arange(count)
+
+    # Equirectangular projection, accurate to well under a pixel at city scale
+    y = np.radians(latitudes) * EARTH_RADIUS_M
+    x = np.radians(longitudes) * EARTH_RADIUS_M * math.cos(math.radians(latitudes.mean()))
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        # Distance of every inner point to the segment start-end at once
+        px = x[start + 1:end] - x[start]
+        py = y[start + 1:end] - y[start]
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        length = dx * dx + dy * dy
+        if length:
+            t = np.clip((px * dx + py * dy) / length, 0, 1)
+            px = px - t * dx
+            py = py - t * dy
+        distances = np.hypot(px, py)
+
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance:
+            farthest += start + 1
+            keep[farthest] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+    return np.flatnonzero(keep)
+
+
+def simplify_history(history, tolerance):
+    kept = simplify(
+        [entry["latitude"] for entry in history], [entry["longitude"] for entry in history], tolerance
+    )
+    return [history[i] for i in kept]
+
+
+def read_simplified_location_history(username, since=None, until=None, tolerance=None, zoom=None):
+    """
+    read_location_history simplified to `tolerance` meters, or to one pixel
+    at map `zoom`. Results are cached per driver, window and tolerance
+    until a new point lands in the window. Windows that are fully archived
+    are not cached, they are simplified on every call.
+    """
+    latest = redis_client.xrevrange(
+        location_history_key(username),
+        max="+" if until is None else until,
+        min="-" if since is None else since,
+        count=1,
+    )
+    if not latest:
+        history = read_location_history(username, since, until)
+        if not history:
+            return []
+        if tolerance is None:
+            tolerance = zoom_tolerance(zoom, history[-1]["latitude"])
+        return simplify_history(history, tolerance)
+
+    latest_id, latest_fields = latest[0]
+    if tolerance is None:
+        tolerance = zoom_tolerance(zoom, float(latest_fields["lat"]))
+
+    cache_key = f"location_history_simplified:{username}:{since}:{until}:{tolerance:.3g}:{latest_id}"
+    cached = redis_client.get(cache_key)
+    if cached:
+        return json.loads(cached)
+
+    simplified = simplify_history(read_location_history(username, since, until), tolerance)
+    redis_client.set(cache_key, json.dumps(simplified), ex=settings.LOCATION_HISTORY_SIMPLIFY_CACHE_TTL)
+    return simplified
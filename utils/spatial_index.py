@@ -0,0 +1,193 @@
+"""
+In-process index of available drivers, the "memory" dispatch search
+backend (DISPATCH_SEARCH_BACKEND).
+
+Positions live in NumPy arrays with one row per driver and a search is a
+vectorized haversine over the rows in the latitude band of the circle, so
+it needs no network hop. The index follows the `dispatch_updates` stream,
+which utils.locations appends to on every change of a driver's dispatch
+membership while the backend is enabled: entries hold `u` (username), `t`
+(User.type) and `lon`/`lat` when the driver can be dispatched, no
+position when they left. It keeps answering from the last known
+positions when Redis is unreachable.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+import redis
+from django.conf import settings
+
+DISPATCH_UPDATES = "dispatch_updates"
+# The radius Redis uses for GEOSEARCH, the backends only differ by its
+# sub-meter quantization of stored positions
+EARTH_RADIUS_KM = 6372.797560856
+
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+
+def enabled():
+    return settings.DISPATCH_SEARCH_BACKEND == "memory"
+
+
+class SpatialIndex:
+    def __init__(self, capacity=1024):
+        self.lock = threading.Lock()
+        self.feed_lock = threading.Lock()
+        self.feed = None
+        self.last_id = "0"
+
+        self.rows = {}
+        self.free = []
+        self.size = 0
+        self.car_type_codes = {}
+        self.usernames = np.empty(capacity, dtype=object)
+        self.car_types = np.zeros(capacity, dtype=np.int16)
+        self.latitudes = np.zeros(capacity)
+        self.longitudes = np.zeros(capacity)
+        self.cos_latitudes = np.zeros(capacity)
+        self.seen = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def grow(self):
+        capacity = len(self.active) * 2
+        for name in ("usernames", "car_types", "latitudes", "longitudes", "cos_latitudes", "seen", "active"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def car_type_code(self, car_type):
+        # 0 is "no type", it never matches a typed search
+        if not car_type:
+            return 0
+        return self.car_type_codes.setdefault(car_type, len(self.car_type_codes) + 1)
+
+    def update(self, username, car_type, longitude, latitude, seen):
+        """
+        Adds the driver at the position, or moves them there. `seen` is the
+        epoch milliseconds of the fix.
+        """
+        with self.lock:
+            row = self.rows.get(username)
+            if row is None:
+                if self.free:
+                    row = self.free.pop()
+                else:
+                    if self.size == len(self.active):
+                        self.grow()
+                    row = self.size
+                    self.size += 1
+                self.rows[username] = row
+                self.usernames[row] = username
+            latitude = math.radians(float(latitude))
+            self.latitudes[row] = latitude
+            self.longitudes[row] = math.radians(float(longitude))
+            self.cos_latitudes[row] = math.cos(latitude)
+            self.car_types[row] = self.car_type_code(car_type)
+            self.seen[row] = seen
+            self.active[row] = True
+
+    def remove(self, username):
+        with self.lock:
+            row = self.rows.pop(username, None)
+            if row is not None:
+                self.active[row] = False
+                self.usernames[row] = None
+                self.free.append(row)
+
+    def search(self, longitude, latitude, radius_km, car_type=None, count=None, max_age=0, withdist=False):
+        """
+        Usernames within `radius_km`, limited to one User.type when given,
+        nearest first and at most `count` when given. `max_age` drops
+        drivers whose last fix is older, in seconds. With `withdist` the
+        items are (username, distance in km).
+        """
+        latitude = math.radians(float(latitude))
+        longitude = math.radians(float(longitude))
+        radius = radius_km / EARTH_RADIUS_KM
+        with self.lock:
+            size = self.size
+            latitudes = self.latitudes[:size]
+            # Nothing outside the latitude band of the circle can be in it
+            mask = self.active[:size] & (np.abs(latitudes - latitude) <= radius)
+            if car_type:
+                mask &= self.car_types[:size] == self.car_type_codes.get(car_type, -1)
+            if max_age:
+                mask &= self.seen[:size] >= (time.time() - max_age) * 1000
+            rows = np.flatnonzero(mask)
+
+            a = (
+                np.sin((latitudes[rows] - latitude) / 2) ** 2
+                + self.cos_latitudes[rows] * math.cos(latitude)
+                * np.sin((self.longitudes[rows] - longitude) / 2) ** 2
+            )
+            distances = 2 * np.arcsin(np.sqrt(np.minimum(a, 1)))
+            within = distances <= radius
+            rows, distances = rows[within], distances[within]
+
+            if count:
+                if count < len(rows):
+                    nearest = np.argpartition(distances, count)[:count]
+                    rows, distances = rows[nearest], distances[nearest]
+                order = np.argsort(distances, kind="stable")
+                rows, distances = rows[order], distances[order]
+            if withdist:
+                return list(zip(self.usernames[rows].tolist(), (distances * EARTH_RADIUS_KM).tolist()))
+            return self.usernames[rows].tolist()
+
+    def apply(self, entries):
+        for entry_id, fields in entries:
+            if "lon" in fields:
+                self.update(fields["u"], fields.get("t"), fields["lon"], fields["lat"], int(entry_id.split("-")[0]))
+            else:
+                self.remove(fields["u"])
+
+    def read(self, block=None, batch=1000):
+        """
+        Applies the next stream entries, returns how many there were.
+        """
+        with self.feed_lock:
+            streams = redis_client.xread({DISPATCH_UPDATES: self.last_id}, count=batch, block=block)
+            read = 0
+            for _, entries in streams:
+                self.apply(entries)
+                self.last_id = entries[-1][0]
+                read += len(entries)
+            return read
+
+    def catch_up(self, batch=1000):
+        """
+        Applies every entry already in the stream.
+        """
+        while self.read(batch=batch) == batch:
+            pass
+
+    def follow(self, block=1000):
+        while True:
+            try:
+                self.read(block=block)
+            except redis.RedisError as e:
+                print(f"[ERROR] Dispatch index feed failed: {e}")
+                time.sleep(1)
+
+    def start(self):
+        """
+        Replays the stream, then keeps following it on a daemon thread.
+        Safe to call more than once.
+        """
+        with self.lock:
+            if self.feed is not None:
+                return
+            self.feed = threading.Thread(target=self.follow, name="dispatch-index-feed", daemon=True)
+        try:
+            self.catch_up()
+        finally:
+            self.feed.start()
+
+
+driver_index = SpatialIndex()